@@ -32,6 +32,81 @@ Structure:
     <path>/<aggregation>/<graph>/<run>/<node>.csv => <epoch>,<time>,<state>
     <path>/<aggregation>/<graph>/<run>/<node>.log
 
+Sessions:
+    One daemon can host several experiments at once. They are listed in the
+    config as "[experiment] sessions = <aggregation>/<graph>/<run>, ...";
+    without that option the single session aggregation/graph/run is used.
+    All sessions share the sockets and the active thread's scheduler, every
+    message carries the id of the session it belongs to:
+    {"session": <aggregation>/<graph>/<run>, "state": <state>}
+    A node that does not host the session answers {"busy": true}, so the
+    active thread moves on to another neighbour at once.
+    Epoch numbers follow the wall clock, a session that falls behind skips
+    epochs instead of drifting away from the other nodes.
+    Every session logs to the logger "session.<session id>". A session's
+    <node>.log gets the lines of that session and the lines of the daemon
+    (sockets, threads, logger "root"), but not those of the other sessions.
+    %(name)s in the [logging] format shows the logger of each line.
+
+Adaptive timing:
+    With an [adaptive] section the active thread measures the round-trip time
+    of every neighbour and the duration of its exchanges. Socket timeouts
+    follow a percentile of the round-trip times and the epoch is split into
+    as many exchange slots as the measured exchange duration allows. Epochs
+    keep their fixed duration, so all nodes agree on the epoch numbers.
+    Options (all optional): timeout_percentile, timeout_factor, min_timeout,
+    max_timeout, period_factor, min_period, window, min_samples
+
+Admission control:
+    With an [admission] section the passive thread hands accepted
+    connections to at most max_concurrent worker threads and answers all
+    further connections at once with {"busy": true}. Workers also answer
+    busy if the session's state stays locked for lock_wait seconds. The
+    active thread then tries another neighbour right away. An over budget
+    connection without a request within busy_timeout seconds (default 0.1)
+    is dropped.
+
+Hierarchy:
+    With a [hierarchy] section the nodes are split into groups, listed in
+    "groups = <file>" as <name_of_host>,<ip_address_of_host>,<group>. The
+    member with the lowest name represents its group. Epochs are run in three
+    tiers:
+        local  (epochs 1 .. local_epochs) => gossip with the neighbours of the
+               own group (all group members if none is a neighbour)
+        global (the next global_epochs) => representatives gossip their group
+               aggregate weighted by the group size,
+               {"session":..., "tier": "global", "state":..., "weight":...}
+        down   (the remaining epochs) => representatives push the result to
+               the members of their group, members that are busy or
+               unreachable get it in a later exchange
+    Every message carries its tier, exchanges from another tier are answered
+    busy. Averaging and counting work as without groups.
+
+Tracing:
+    With a [trace] section every exchange is appended to
+    <path>/<aggregation>/<graph>/<run>/<node>.trace, a header
+    ("GTRC", version, own IPv4 address, initial state) followed by fixed
+    size records (little endian, see GossipTracer.RECORD):
+        <exchange id>,<epoch>,<start>,<end>,<peer IPv4>,<role>,<outcome>,
+        <kind>,<sent state>,<sent weight>,<received state>,<received weight>
+    The active side draws the exchange id and sends it along ("xid"), so both
+    sides of an exchange can be matched. Missing weights are NaN. <start> is
+    the time the side got the session's state lock (refused exchanges: the
+    time the request arrived).
+    gossip_replay.py merges the traces of all nodes and replays them.
+
+Profiling:
+    SIGUSR1 profiles the active thread, the passive thread and the main
+    thread (logging, storing results) for a window of seconds. Afterwards
+    one file per thread is written to the experiment folder:
+    <node>_<thread>_epoch<epoch>.prof (cProfile, deterministic mode) or
+    <node>_<thread>_epoch<epoch>.stacks (collapsed stacks, sampling mode).
+    Options of the optional [profiling] section: mode, window, interval
+
+Collector:
+    With "[collector] address = <host>:<port>" every session's state is sent
+    to gossip_collector.py at the end of each epoch (UDP, fire and forget).
+
 
 Next steps:
  TODO: check that no unrelated traffic blocks the connections
@@ -47,10 +122,19 @@ import socket
 import threading
 import json
 import time
+import math
 import ConfigParser
 import argparse
 import signal
+import heapq
+import struct
+import collections
+import cProfile
+
 
+class GossipBusy(Exception):
+    """ the other side does not take any more exchanges right now """
+    pass
 
 class GossipEpoch(object):
     """ managing the epochs of the gossip algorithm """
@@ -74,12 +158,32 @@ class GossipEpoch(object):
             raise Exception("Not started yet start time is already over... \
                 Exiting...")
 
-    def next_epoch(self):
-        """ proceed to the next epoch (blocking) """
+    def synchronise(self, start_time):
+        """ adopt the start time of an already started epoch (non-blocking) """
+        self._start_time = start_time
+
+    def advance(self):
+        """ proceed to the next epoch without waiting for it """
         self._epoch += 1
         self._logger.debug("Next epoch: %s", self._epoch)
+
+    def advance_to(self, now):
+        """ proceed to the epoch the time now falls into (at least to the
+            next one, at most to the last one), returns the number of
+            skipped epochs
+        """
+        epoch = max(self._epoch + 1, int(math.floor(
+            (now - self._start_time) / self._epoch_duration)))
+        skipped = epoch - self._epoch - 1
+        self._epoch = min(epoch, self._max_epoch)
+        self._logger.debug("Next epoch: %s", self._epoch)
+        return skipped
+
+    def next_epoch(self):
+        """ proceed to the next epoch (blocking) """
+        next_cycle = self.next_cycle_time
+        self.advance()
         # sleep till next epoch
-        next_cycle = self._epoch * self._epoch_duration + self._start_time
         sleep_time = next_cycle - time.time()
         self._logger.debug("sleeping for %s", sleep_time)
         if sleep_time > 0:
@@ -106,15 +210,32 @@ class GossipEpoch(object):
         """ integer value of epoch """
         return self._epoch
 
+    @property
+    def duration(self):
+        """ length of an epoch in seconds """
+        return self._epoch_duration
+
+    @property
+    def start_time(self):
+        """ time at which epoch 0 started """
+        return self._start_time
+
+    @property
+    def next_cycle_time(self):
+        """ time at which the next epoch starts """
+        return (self._epoch + 1) * self._epoch_duration + self._start_time
+
 class GossipState(object):
     """ managing the state of the gossip algorithm """
 
     def __init__(self, logger, initial_state, gossip_epoch):
         self._state = initial_state
+        self._initial_state = initial_state
         self._gossip_epoch = gossip_epoch
         self._logger = logger
         self._state_history = []
         self._lock = threading.Lock()
+        self._weight = 1.0
 
     def get_and_acquire(self):
         """ get current state and acquire lock """
@@ -122,22 +243,63 @@ class GossipState(object):
         self._logger.debug("acquired lock")
         return self._state
 
-    def update_and_release(self, new_state):
+    def try_get_and_acquire(self, timeout):
+        """ get current state and acquire lock, raise GossipBusy if the lock
+            is not free within timeout seconds
+        """
+        deadline = time.time() + timeout
+        while not self._lock.acquire(False):
+            if time.time() >= deadline:
+                raise GossipBusy("state is locked")
+            time.sleep(0.01)
+        self._logger.debug("acquired lock")
+        return self._state
+
+    def release(self):
+        """ release lock without updating the state """
+        self._lock.release()
+        self._logger.debug("releasing lock")
+
+    def merge(self, state, weight, new_state, new_weight):
+        """ merge rule, returns the new state and weight
+            With a weight the states are averaged weighted and both sides
+            keep half of the summed weight, so the total mass is unchanged.
+        """
+        if new_weight is None:
+            return (state + new_state) / 2.0, weight
+        total = weight + new_weight
+        return (weight * state + new_weight * new_state) / total, total / 2.0
+
+    def update_and_release(self, new_state, new_weight=None):
         """ update state, add to history and release lock """
-        def aggregate(state, new_state):
-            """ Aggregate states """
-            return (state + new_state) / 2.0
-        self._state = aggregate(self._state, new_state)
+        self._state, self._weight = self.merge(self._state, self._weight,
+            new_state, new_weight)
         self._logger.debug("Received state %s, new state %s", new_state,
             self._state)
+        self._record()
+        self._lock.release()
+        self._logger.debug("releasing lock")
+        return self._state
+
+    def replace_and_release(self, new_state):
+        """ take over new_state, add to history and release lock """
+        self._state = new_state
+        self._logger.debug("Replaced state by %s", new_state)
+        self._record()
+        self._lock.release()
+        self._logger.debug("releasing lock")
+        return self._state
+
+    def reweight(self, weight):
+        """ set the weight of the state (lock must be held) """
+        self._weight = weight
+
+    def _record(self):
         self._state_history.append([ # TODO: add node name of neighbour
             str(self._gossip_epoch.curr_epoch),
             str(time.time()),
             str(self._state)
         ])
-        self._lock.release()
-        self._logger.debug("releasing lock")
-        return self._state
 
     def emergency_release(self):
         """ used in case of errors """
@@ -150,6 +312,21 @@ class GossipState(object):
         """ all states collected so far """
         return self._state_history
 
+    @property
+    def current(self):
+        """ current state (without locking) """
+        return self._state
+
+    @property
+    def initial(self):
+        """ state the session started with """
+        return self._initial_state
+
+    @property
+    def weight(self):
+        """ number of nodes the state stands for (1 without hierarchy) """
+        return self._weight
+
 class GossipSocket(object):
     def __init__(self, ip_addr, config, logger):
         self.recv_port = int(config.get('network', 'recv_port'))
@@ -159,6 +336,7 @@ class GossipSocket(object):
         self.logger = logger
         self.connection = None
         self.sock = None
+        self.timeout = None
         socket.setdefaulttimeout(float(config.get('network', 'timeout')))
 
     def create_socket(self, port):
@@ -180,31 +358,40 @@ class GossipSocket(object):
             raise
         return sock
 
-    def connect(self, target_ip_addr):
+    def connect(self, target_ip_addr, pause=1):
         """ connect to IP, create new socket """
         self.logger.debug("Connecting to address %s", target_ip_addr)
         if self.sock:
             self.logger.debug("connection exists, recreating socket")
+            # reset instead of closing, a close on this side would keep the
+            # send port in TIME_WAIT and the next bind would fail
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                struct.pack('ii', 1, 0))
             self.sock.close()
-            time.sleep(1)
+            time.sleep(pause)
         self.sock = self.create_socket(self.send_port)
+        if self.timeout:
+            self.sock.settimeout(self.timeout)
         self.sock.connect((target_ip_addr, self.recv_port))
         self.logger.debug("Created connection to %s at port %s",
             target_ip_addr, self.recv_port)
         self.connection = self.sock
 
-    def accept(self):
-        """ accept incoming connections """
-        self.logger.debug("Accepting connections")
+    def listen(self):
+        """ create the listening socket, if it does not exist yet """
         if not self.sock:
             self.logger.debug("socket does not exist, creating socket")
             self.sock = self.create_socket(self.recv_port)
             self.sock.listen(5000)
-        if self.connection:
-            self.connection.close()
-        self.connection, address = self.sock.accept()
+
+    def accept(self):
+        """ accept incoming connections """
+        self.logger.debug("Accepting connections")
+        self.listen()
+        connection, address = self.sock.accept()
         self.logger.debug("Accepted connection from %s at port %s",
             address[0], address[1])
+        return GossipConnection(connection, self.buf_size, address[0])
 
     def send(self, data):
         """ put data into json format and send message """
@@ -220,98 +407,743 @@ class GossipSocket(object):
         message = self.connection.recv(self.buf_size)
         return json.loads(message)
 
+class GossipConnection(object):
+    """ one accepted connection """
+    def __init__(self, connection, buf_size, address=None):
+        self.connection = connection
+        self.buf_size = buf_size
+        self.address = address
+
+    def send(self, data):
+        """ put data into json format and send message """
+        self.connection.send(json.dumps(data))
+
+    def recv(self):
+        """ receive and un-json data """
+        return json.loads(self.connection.recv(self.buf_size))
+
+    def settimeout(self, timeout):
+        self.connection.settimeout(timeout)
+
+    def close(self):
+        self.connection.close()
+
+class GossipSession(object):
+    """ one experiment hosted by the daemon """
+    def __init__(self, session_id, g_state, g_epoch):
+        self.session_id = session_id
+        self.gossip_state = g_state
+        self.gossip_epoch = g_epoch
+        self.output_file = None
+        self.log_file = None
+        self.trace_file = None
+
+    def finished(self):
+        """ check for end of this session's experiment """
+        return self.gossip_epoch.last_epoch_reached()
+
+class GossipReporter(object):
+    """ report states to the collector without waiting for it """
+    def __init__(self, node_name, address, logger):
+        host, port = address.rsplit(':', 1)
+        self.address = (host, int(port))
+        self.node_name = node_name
+        self.logger = logger
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(0)
+
+    def report(self, session):
+        """ send the state of the session at the end of its current epoch """
+        message = json.dumps({
+            'session': session.session_id,
+            'node': self.node_name,
+            'epoch': session.gossip_epoch.curr_epoch,
+            'state': session.gossip_state.current
+        })
+        try:
+            self.sock.sendto(message, self.address)
+        except socket.error:
+            self.logger.warn("could not report to collector %s:%s",
+                *self.address)
+
+def percentile(values, percent):
+    """ nearest-rank percentile of a list of numbers """
+    ordered = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(ordered)))
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+class GossipTiming(object):
+    """ socket timeouts and gossip period from measured round-trip times """
+    def __init__(self, config, logger):
+        def option(name, default):
+            if config.has_option('adaptive', name):
+                return float(config.get('adaptive', name))
+            return default
+        self.logger = logger
+        self.max_timeout = option('max_timeout',
+            float(config.get('network', 'timeout')))
+        self.min_timeout = option('min_timeout', 0.1)
+        self.timeout_percentile = option('timeout_percentile', 99)
+        self.timeout_factor = option('timeout_factor', 2)
+        self.min_period = option('min_period', 1)
+        self.period_factor = option('period_factor', 2)
+        self.window = int(option('window', 50))
+        self.min_samples = int(option('min_samples', 5))
+        self._rtts = {}
+        self._durations = collections.deque(maxlen=self.window)
+        # last values handed out, changes are logged
+        self._timeouts = {}
+        self._slots = 1
+
+    def add_rtt(self, neighbour, rtt):
+        """ round-trip time of a completed exchange """
+        if neighbour not in self._rtts:
+            self._rtts[neighbour] = collections.deque(maxlen=self.window)
+        self._rtts[neighbour].append(rtt)
+
+    def add_timeout(self, neighbour):
+        """ a timed out exchange took at least the timeout """
+        self.add_rtt(neighbour, self.timeout(neighbour))
+
+    def add_duration(self, duration):
+        """ time the state was locked by an exchange """
+        self._durations.append(duration)
+
+    def timeout(self, neighbour):
+        """ socket timeout for the next exchange with neighbour """
+        samples = self._rtts.get(neighbour, ())
+        if len(samples) < self.min_samples:
+            samples = [rtt for rtts in self._rtts.values() for rtt in rtts]
+        if len(samples) < self.min_samples:
+            return self.max_timeout
+        timeout = self.timeout_factor * percentile(samples,
+            self.timeout_percentile)
+        timeout = min(max(timeout, self.min_timeout), self.max_timeout)
+        if timeout != self._timeouts.get(neighbour):
+            self.logger.debug("timeout of %s: %.3f s", neighbour, timeout)
+            self._timeouts[neighbour] = timeout
+        return timeout
+
+    def slots(self, epoch_duration):
+        """ number of exchanges per epoch """
+        if len(self._durations) < self.min_samples:
+            return 1
+        period = self.period_factor * percentile(self._durations, 95)
+        period = min(max(period, self.min_period), epoch_duration)
+        slots = max(int(epoch_duration / period + 1e-9), 1)
+        if slots != self._slots:
+            self.logger.debug("%s exchanges per epoch", slots)
+            self._slots = slots
+        return slots
+
+class GossipProfiler(object):
+    """ profile the daemon's threads for a window of time on request """
+    def __init__(self, config, node_name, folder, sessions, logger):
+        def option(name, default):
+            if config.has_option('profiling', name):
+                return config.get('profiling', name)
+            return default
+        self.mode = option('mode', 'deterministic')
+        if self.mode not in ('deterministic', 'sampling'):
+            raise ValueError("unknown profiling mode %s" % self.mode)
+        self.window = float(option('window', 30))
+        self.interval = float(option('interval', 0.01))
+        self.node_name = node_name
+        self.folder = folder
+        self.sessions = sessions
+        self.logger = logger
+        self._until = 0
+        self._epoch = 0
+        self._profiles = {}
+        self._threads = {}
+        self._stacks = {}
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return time.time() < self._until
+
+    def request(self):
+        """ start a profiling window (called from the signal handler) """
+        if self.active:
+            self.logger.warn("already profiling")
+            return
+        self._epoch = max(session.gossip_epoch.curr_epoch
+            for session in self.sessions.values())
+        self._until = time.time() + self.window
+        self.logger.warn("profiling (%s) for %s seconds", self.mode,
+            self.window)
+        if self.mode == 'sampling':
+            sampler = threading.Thread(target=self._sample)
+            sampler.daemon = True
+            sampler.start()
+
+    def checkpoint(self, name):
+        """ called regularly by every profiled thread """
+        with self._lock:
+            self._threads[name] = threading.current_thread().ident
+        if self.mode == 'sampling':
+            return
+        profile = self._profiles.get(name)
+        if self.active and profile is None:
+            profile = cProfile.Profile()
+            self._profiles[name] = profile
+            profile.enable()
+        elif not self.active and profile is not None:
+            self.finish(name)
+
+    def finish(self, name):
+        """ stop profiling the calling thread and write its stats """
+        profile = self._profiles.pop(name, None)
+        if profile is None:
+            return
+        profile.disable()
+        try:
+            profile.dump_stats(self.file_name(name, 'prof'))
+        except (OSError, IOError):
+            self.logger.exception("could not write profile of %s", name)
+
+    def file_name(self, name, extension):
+        return os.path.join(self.folder, "%s_%s_epoch%s.%s" % (
+            self.node_name, name, self._epoch, extension))
+
+    def _sample(self):
+        """ count the stacks of the profiled threads until the window ends """
+        stacks = dict((name, collections.Counter()) for name in self._threads)
+        while self.active:
+            frames = sys._current_frames()
+            with self._lock:
+                threads = self._threads.items()
+            for name, ident in threads:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("%s:%s:%s" % (os.path.basename(
+                        code.co_filename), code.co_name, frame.f_lineno))
+                    frame = frame.f_back
+                stacks.setdefault(name, collections.Counter())[
+                    ';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+        for name, counter in stacks.items():
+            try:
+                with open(self.file_name(name, 'stacks'), 'w') as f:
+                    for stack, count in counter.most_common():
+                        f.write("%s %s\n" % (stack, count))
+            except (OSError, IOError):
+                self.logger.exception("could not write stacks of %s", name)
+
+class GossipHierarchy(object):
+    """ groups, representatives and tiers of two-tier aggregation """
+    def __init__(self, config, node_name, dict_of_neighbours, logger):
+        self.logger = logger
+        self.node_name = node_name
+        self.local_epochs = int(config.get('hierarchy', 'local_epochs'))
+        self.global_epochs = int(config.get('hierarchy', 'global_epochs'))
+        groups = self.read_file_of_groups(config.get('hierarchy', 'groups'))
+        if node_name not in groups:
+            raise ValueError("%s is not in any group" % node_name)
+        self.group = groups[node_name][1]
+        members = dict((name, ip) for name, (ip, group) in groups.items()
+            if group == self.group)
+        self.size = len(members)
+        # lowest name per group, known to every node without messages
+        self.representatives = {}
+        for name in sorted(groups, reverse=True):
+            self.representatives[groups[name][1]] = (name, groups[name][0])
+        self.is_representative = \
+            self.representatives[self.group][0] == node_name
+        del members[node_name]
+        self.members = members
+        self.local_neighbours = dict((name, ip) for name, ip in
+            dict_of_neighbours.items() if name in members) or dict(members)
+        self.other_representatives = dict(
+            self.representatives[group] for group in self.representatives
+            if group != self.group)
+        # members that got the result, per session
+        self._delivered = collections.defaultdict(set)
+        # sessions whose state carries the group weight
+        self._weighted = set()
+
+    @staticmethod
+    def read_file_of_groups(file_groups):
+        """ {<node>: (<ip>, <group>)} of <node>,<ip>,<group> lines """
+        groups = {}
+        separator = re.compile(r',\s?')
+        with open(file_groups, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    name, ip, group = separator.split(line.strip())
+                except ValueError:
+                    raise ValueError("group file is ill-formatted")
+                groups[name] = (ip, group)
+        return groups
+
+    def tier(self, session):
+        """ 'local', 'global' or 'down' for the session's current epoch """
+        epoch = session.gossip_epoch.curr_epoch
+        if epoch <= self.local_epochs:
+            return 'local'
+        if epoch <= self.local_epochs + self.global_epochs:
+            return 'global'
+        return 'down'
+
+    def neighbours(self, session):
+        """ nodes the active thread exchanges with in the current tier """
+        tier = self.tier(session)
+        if tier == 'local':
+            return self.local_neighbours
+        if not self.is_representative:
+            return {}
+        if tier == 'global':
+            return self.other_representatives
+        delivered = self._delivered[session.session_id]
+        return dict((name, ip) for name, ip in self.members.items()
+            if name not in delivered)
+
+    def delivered(self, session, member):
+        """ member took over the result of the session """
+        self._delivered[session.session_id].add(member)
+
+    def tag(self, session):
+        """ fields of an outgoing message (session's lock must be held) """
+        tier = self.tier(session)
+        if tier != 'global':
+            return {'tier': tier}
+        if session.session_id not in self._weighted:
+            # the group aggregate stands for all members of the group
+            self._weighted.add(session.session_id)
+            session.gossip_state.reweight(float(self.size))
+        return {'tier': tier, 'weight': session.gossip_state.weight}
+
+class GossipTracer(object):
+    """ binary record of every exchange, one file per session """
+    MAGIC = 'GTRC'
+    VERSION = 2
+    HEADER = struct.Struct('<4sB4sd')
+    RECORD = struct.Struct('<QIdd4sBBBdddd')
+    ACTIVE, PASSIVE = 0, 1
+    OK, BUSY, TIMEOUT, ERROR = 0, 1, 2, 3
+    MERGE, REPLACE = 0, 1
+
+    def __init__(self, node_ip, logger):
+        self.node_ip = node_ip
+        self.logger = logger
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def record(self, session, xid, role, outcome, start, peer_ip, sent,
+            received=None):
+        """ append one exchange, sent and received are the messages """
+        if session.trace_file is None:
+            return
+        nan = float('nan')
+        if received is None or 'state' not in received:
+            received = {}
+        record = self.RECORD.pack(
+            xid,
+            session.gossip_epoch.curr_epoch,
+            start,
+            time.time(),
+            socket.inet_aton(peer_ip or '0.0.0.0'),
+            role,
+            outcome,
+            self.REPLACE if sent.get('tier') == 'down' else self.MERGE,
+            sent.get('state', nan),
+            sent.get('weight', nan),
+            received.get('state', nan),
+            received.get('weight', nan)
+        )
+        with self._lock:
+            trace = self._files.get(session.session_id)
+            if trace is None:
+                trace = open(session.trace_file, 'wb')
+                trace.write(self.HEADER.pack(self.MAGIC, self.VERSION,
+                    socket.inet_aton(self.node_ip),
+                    session.gossip_state.initial))
+                self._files[session.session_id] = trace
+            trace.write(record)
+
+    def close(self):
+        """ flush and close all trace files """
+        with self._lock:
+            for trace in self._files.values():
+                trace.close()
+            self._files = {}
+
 class GossipThread(threading.Thread):
-    def __init__(self, config, logger, g_state, g_epoch, g_socket):
+    def __init__(self, config, logger, sessions, g_socket):
         self.config = config
         self.logger = logger
-        self.gossip_state = g_state
-        self.gossip_epoch = g_epoch
+        self.sessions = sessions
         self.gossip_socket = g_socket
+        self.reporter = None
+        self.timing = None
+        self.profiler = None
+        self.hierarchy = None
+        self.tracer = None
         self.address = ('', 5000)
         super(GossipThread, self).__init__()
 
+    def all_finished(self):
+        """ check whether every session reached its last epoch """
+        for session in self.sessions.values():
+            if not session.finished():
+                return False
+        return True
+
+    def stop_all(self):
+        """ stop all sessions now """
+        for session in self.sessions.values():
+            session.gossip_epoch.stop()
+
 class ActiveGossipThread(GossipThread):
     def __init__(self, dict_of_neighbours, *args):
         self.dict_of_neighbours = dict_of_neighbours
         super(ActiveGossipThread, self).__init__(*args)
 
+    def exchange(self, session):
+        """ push-pull the state of one session with a random neighbour,
+            move on to the next one while neighbours are busy
+        """
+        if self.hierarchy:
+            dict_of_neighbours = self.hierarchy.neighbours(session)
+            if not dict_of_neighbours:
+                return
+            if self.hierarchy.tier(session) == 'down':
+                self.push_down(session, dict_of_neighbours)
+                return
+        else:
+            dict_of_neighbours = self.dict_of_neighbours
+        neighbours = dict_of_neighbours.keys()
+        random.shuffle(neighbours)
+        for neighbour in neighbours:
+            try:
+                self.exchange_with(session, neighbour,
+                    dict_of_neighbours[neighbour])
+            except GossipBusy:
+                self.logger.debug("%s is busy", neighbour)
+            else:
+                return
+        raise GossipBusy("all neighbours are busy")
+
+    def trace(self, session, outcome, start, peer_ip, request,
+            message=None):
+        """ record an exchange started by this node """
+        if self.tracer:
+            self.tracer.record(session, request['xid'], GossipTracer.ACTIVE,
+                outcome, start, peer_ip, request, message)
+
+    def push_down(self, session, members):
+        """ hand the result of the session to all members of the group,
+            members that are busy or unreachable get it in a later exchange
+        """
+        for member, member_ip in sorted(members.items()):
+            try:
+                self.exchange_with(session, member, member_ip)
+            except GossipBusy:
+                self.logger.debug("%s is busy", member)
+            except socket.error as e:
+                self.logger.warn("could not push to %s: %s", member, e)
+                session.gossip_state.emergency_release()
+            else:
+                self.hierarchy.delivered(session, member)
+
+    def exchange_with(self, session, neighbour, neighbour_ip):
+        """ push-pull the state of one session with neighbour """
+        if self.timing:
+            self.gossip_socket.timeout = self.timing.timeout(neighbour)
+        msg_send = session.gossip_state.get_and_acquire()
+        locked = time.time()
+        request = {'session': session.session_id, 'state': msg_send}
+        if self.hierarchy:
+            request.update(self.hierarchy.tag(session))
+        if self.tracer:
+            request['xid'] = random.getrandbits(64)
+        try:
+            # no reconnect pause, it would hold up all sessions
+            self.gossip_socket.connect(neighbour_ip, 0)
+            sent = time.time()
+            self.gossip_socket.send(request)
+            message = self.gossip_socket.recv()
+        except socket.timeout:
+            if self.timing:
+                self.timing.add_timeout(neighbour)
+            self.trace(session, GossipTracer.TIMEOUT, locked, neighbour_ip,
+                request)
+            raise
+        except:
+            self.trace(session, GossipTracer.ERROR, locked, neighbour_ip,
+                request)
+            raise
+        if message.get('busy'):
+            session.gossip_state.release()
+            self.trace(session, GossipTracer.BUSY, locked, neighbour_ip,
+                request, message)
+            raise GossipBusy(neighbour)
+        if self.timing:
+            self.timing.add_rtt(neighbour, time.time() - sent)
+            self.timing.add_duration(time.time() - locked)
+        if request.get('tier') == 'down':
+            # the result flows down only
+            session.gossip_state.release()
+        else:
+            session.gossip_state.update_and_release(message['state'],
+                message.get('weight'))
+        # only once the lock is released, tracing may fail
+        self.trace(session, GossipTracer.OK, locked, neighbour_ip, request,
+            message)
+
+    def exchange_times(self, session, epoch_start):
+        """ when to exchange in the epoch that started at epoch_start """
+        if not self.timing:
+            return [epoch_start + random.randint(0,
+                int(session.gossip_epoch.duration * 100)) / 100.0]
+        slots = self.timing.slots(session.gossip_epoch.duration)
+        slot_length = session.gossip_epoch.duration / float(slots)
+        return [epoch_start + slot * slot_length +
+            random.uniform(0, slot_length) for slot in xrange(slots)]
+
     def run(self):
-        """ wait for nodes asking for the state and reply
+        """ start an exchange for every session at a random time of each of
+            its epochs
         """
-        locked_by_me = False
         error_count = 0
         error_limit = int(self.config.get('threads', 'max_error'))
         self.logger.debug("running active thread")
-        while not self.gossip_epoch.last_epoch_reached():
-            sys.stdout.write('.')
-            sys.stdout.flush()
+        # (due time, sequence number, action, session)
+        queue = []
+        for seq, session in enumerate(self.sessions.values()):
+            queue.append(
+                (session.gossip_epoch.next_cycle_time, seq, 'epoch', session)
+            )
+        heapq.heapify(queue)
+        seq = len(queue)
+        # exchanges left in the current epoch of each session
+        remaining = {}
+        # epoch 0 is reported before any exchange, with the initial state
+        if self.reporter:
+            for session in self.sessions.values():
+                self.reporter.report(session)
+        while queue:
+            if self.profiler:
+                self.profiler.checkpoint('active')
+            due, _, action, session = heapq.heappop(queue)
+            if action == 'epoch' and session.finished():
+                continue
+            sleep_time = due - time.time()
+            if sleep_time > 0:
+                time.sleep(sleep_time)
+            if action == 'epoch':
+                sys.stdout.write('.')
+                sys.stdout.flush()
+                g_epoch = session.gossip_epoch
+                if self.reporter and g_epoch.curr_epoch > 0:
+                    self.reporter.report(session)
+                # the epoch follows the wall clock, late sessions skip epochs
+                skipped = g_epoch.advance_to(time.time())
+                if skipped:
+                    self.logger.warn("session %s skipped %s epochs",
+                        session.session_id, skipped)
+                if time.time() >= g_epoch.next_cycle_time:
+                    # already past the end of the last epoch
+                    if self.reporter:
+                        self.reporter.report(session)
+                    continue
+                exchange_times = self.exchange_times(session,
+                    g_epoch.next_cycle_time - g_epoch.duration)
+                remaining[session.session_id] = len(exchange_times)
+                for exchange_time in exchange_times:
+                    heapq.heappush(queue,
+                        (exchange_time, seq, 'exchange', session))
+                    seq += 1
+                continue
             try:
-                self.gossip_epoch.next_epoch() # TODO
-                time.sleep(random.randint(0, 400) / 100.0)
-                locked_by_me = True
-                neighbour = random.choice(self.dict_of_neighbours.keys())
-                neighbour_ip = self.dict_of_neighbours[neighbour]
-                msg_send = self.gossip_state.get_and_acquire()
-                self.gossip_socket.connect(neighbour_ip)
-                self.gossip_socket.send(msg_send)
-                new_state = self.gossip_socket.recv()
-                self.gossip_state.update_and_release(new_state)
+                self.exchange(session)
+            except GossipBusy:
+                self.logger.debug("no neighbour took the exchange")
             except socket.timeout:
                 self.logger.debug("active thread timed out XXX")
-                if locked_by_me:
-                    self.gossip_state.emergency_release()
-                    time.sleep(1)
-                    locked_by_me = False
+                session.gossip_state.emergency_release()
             except:
-                if locked_by_me:
-                    self.gossip_state.emergency_release()
-                    time.sleep(1)
-                    locked_by_me = False
+                session.gossip_state.emergency_release()
                 error_count += 1
                 self.logger.exception("active thread had %s error!" %
                     error_count)
                 if error_count >= error_limit:
                     self.logger.error("active thread had 10 errors!")
                     print "FAILED"
-                    self.gossip_epoch.stop()
+                    self.stop_all()
+            remaining[session.session_id] -= 1
+            if remaining[session.session_id] > 0:
+                continue
+            if not session.finished():
+                due = session.gossip_epoch.next_cycle_time
+                heapq.heappush(queue, (due, seq, 'epoch', session))
+                seq += 1
+            elif self.reporter:
+                self.reporter.report(session)
+        if self.profiler:
+            self.profiler.finish('active')
+
+class GossipAdmission(object):
+    """ bounded number of concurrent passive exchanges """
+    def __init__(self, config, logger):
+        self.logger = logger
+        self.max_concurrent = int(config.get('admission', 'max_concurrent')) \
+            if config.has_option('admission', 'max_concurrent') else 1
+        self.lock_wait = float(config.get('admission', 'lock_wait')) \
+            if config.has_option('admission', 'lock_wait') else None
+        self.busy_timeout = float(config.get('admission', 'busy_timeout')) \
+            if config.has_option('admission', 'busy_timeout') else 0.1
+        self._budget = threading.BoundedSemaphore(self.max_concurrent)
+
+    def admit(self, connection, serve):
+        """ serve connection in its own thread, False if over budget """
+        if not self._budget.acquire(False):
+            return False
+        thread = threading.Thread(target=self._serve,
+            args=(connection, serve))
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def _serve(self, connection, serve):
+        try:
+            serve(connection)
+        except socket.timeout:
+            self.logger.warn("passive exchange timed out")
+        except:
+            self.logger.exception("passive exchange failed")
+        finally:
+            connection.close()
+            self._budget.release()
 
 class PassiveGossipThread(GossipThread):
     def __init__(self, *args):
+        self.admission = None
         super(PassiveGossipThread, self).__init__(*args)
 
+    def serve(self, connection):
+        """ answer one exchange on an accepted connection """
+        message = connection.recv()
+        # refused exchanges start on arrival, the others once locked
+        start = time.time()
+        session = self.sessions.get(message['session'])
+        if session is None:
+            self.logger.warn("message for unknown session %s",
+                message['session'])
+            connection.send({'session': message['session'], 'busy': True})
+            return
+        gossip_state = session.gossip_state
+        busy = {'session': session.session_id, 'busy': True}
+        if self.hierarchy and \
+                message.get('tier') != self.hierarchy.tier(session):
+            self.logger.debug("exchange of tier %s in tier %s",
+                message.get('tier'), self.hierarchy.tier(session))
+            connection.send(busy)
+            self.trace(session, GossipTracer.BUSY, start, connection,
+                busy, message)
+            return
+        if self.admission and self.admission.lock_wait is not None:
+            try:
+                msg_send = gossip_state.try_get_and_acquire(
+                    self.admission.lock_wait)
+            except GossipBusy:
+                connection.send(busy)
+                self.trace(session, GossipTracer.BUSY, start, connection,
+                    busy, message)
+                return
+        else:
+            msg_send = gossip_state.get_and_acquire()
+        start = time.time()
+        reply = {'session': session.session_id, 'state': msg_send}
+        try:
+            if self.hierarchy:
+                reply.update(self.hierarchy.tag(session))
+            connection.send(reply)
+        except:
+            gossip_state.release()
+            self.trace(session, GossipTracer.ERROR, start, connection, reply,
+                message)
+            raise
+        if message.get('tier') == 'down':
+            gossip_state.replace_and_release(message['state'])
+        else:
+            gossip_state.update_and_release(message['state'],
+                message.get('weight'))
+        # only once the lock is released, tracing may fail
+        self.trace(session, GossipTracer.OK, start, connection, reply,
+            message)
+
+    def trace(self, session, outcome, start, connection, reply, message):
+        """ record an exchange started by a neighbour """
+        if self.tracer and 'xid' in message:
+            self.tracer.record(session, message['xid'], GossipTracer.PASSIVE,
+                outcome, start, getattr(connection, 'address', None), reply,
+                message)
+
     def run(self):
         """ wait for nodes asking for the state and reply
         """
-        locked_by_me = False
         error_count = 0
         error_limit = int(self.config.get('threads', 'max_error'))
         self.logger.debug("running passive thread")
-        while not self.gossip_epoch.last_epoch_reached():
+        while not self.all_finished():
+            if self.profiler:
+                self.profiler.checkpoint('passive')
+            connection = None
             try:
-                msg_send = self.gossip_state.get_and_acquire()
-                locked_by_me = True
-                self.gossip_socket.accept()
-                new_state = self.gossip_socket.recv()
-                self.gossip_socket.send(msg_send)
-                self.gossip_state.update_and_release(new_state)
+                connection = self.gossip_socket.accept()
+                if self.admission is None:
+                    self.serve(connection)
+                elif self.admission.admit(connection, self.serve):
+                    connection = None
+                else:
+                    # read the request, closing with unread data resets the
+                    # connection before the busy reply arrives. A peer that
+                    # sends nothing must not hold up the accept loop.
+                    connection.settimeout(self.admission.busy_timeout)
+                    try:
+                        message = connection.recv()
+                    except socket.timeout:
+                        self.logger.debug("no request, dropping connection")
+                    else:
+                        self.logger.debug("over budget, sending busy")
+                        connection.send({
+                            'session': message.get('session'), 'busy': True
+                        })
             except socket.timeout:
                 self.logger.warn("passive thread timed out")
-                if locked_by_me:
-                    self.gossip_state.emergency_release()
-                    time.sleep(1)
-                    locked_by_me = False
             except:
-                if locked_by_me:
-                    self.gossip_state.emergency_release()
-                    time.sleep(1)
-                    locked_by_me = False
                 error_count += 1
                 self.logger.exception("passive thread had %s error!" %
                     error_count)
-                if error_count < error_limit:
+                if error_count >= error_limit:
                     self.logger.error("passive thread had 10 errors!")
                     print "FAILED"
-                    self.gossip_epoch.stop()
+                    self.stop_all()
+            finally:
+                if connection:
+                    connection.close()
+        if self.profiler:
+            self.profiler.finish('passive')
+
+class SessionLogFilter(logging.Filter):
+    """ pass the lines of the daemon and of one session """
+    PREFIX = 'session.'
+
+    def __init__(self, session_id):
+        super(SessionLogFilter, self).__init__()
+        self.logger_name = self.PREFIX + session_id
+
+    def filter(self, record):
+        return not record.name.startswith(self.PREFIX) or \
+            record.name == self.logger_name
 
 class BaseDaemon(object):
     def __init__(self):
@@ -333,13 +1165,15 @@ class BaseDaemon(object):
         configx.read(configuration_path)
         return configx
 
-    def create_logger(self, formatter, path_to_file):
+    def create_logger(self, formatter, path_to_file, log_filter=None):
         """ create logging object """
         logx = logging.getLogger()
         file_handler = logging.FileHandler(path_to_file, mode='w')
         file_handler.setFormatter(
             logging.Formatter(formatter)
         )
+        if log_filter:
+            file_handler.addFilter(log_filter)
         logx.addHandler(file_handler)
         logx.setLevel(logging.DEBUG)
         return logx
@@ -367,17 +1201,50 @@ class GossipDaemon(BaseDaemon):
         args = self.parse_arguments("Gossip aggregator agent", options)
         self.config = self.parse_config(args.configpath)
         self.threads = {}
-        self.gepoch = GossipEpoch(
-            self.logger,
-            int(args.start_time),
-            int(self.config.get('epochs', 'max')),
-            int(self.config.get('epochs', 'duration'))
-        )
-        statexxx = random.randint(0, 1000) * 1.0
-        self.gstate = GossipState(self.logger, statexxx, self.gepoch)
+        self.profiler = None
+        signal.signal(signal.SIGUSR1, self.profile_handler)
+        self.sessions = {}
+        for session_id in self.session_ids():
+            session_logger = logging.getLogger(
+                SessionLogFilter.PREFIX + session_id
+            )
+            gepoch = GossipEpoch(
+                session_logger,
+                int(args.start_time),
+                int(self.config.get('epochs', 'max')),
+                int(self.config.get('epochs', 'duration'))
+            )
+            statexxx = random.randint(0, 1000) * 1.0
+            gstate = GossipState(session_logger, statexxx, gepoch)
+            self.sessions[session_id] = GossipSession(
+                session_id, gstate, gepoch
+            )
+
+    def session_ids(self):
+        """ ids of all experiments hosted by this daemon
+            <aggregation>/<graph>/<run>
+        """
+        if self.config.has_option('experiment', 'sessions'):
+            separator = re.compile(r',\s*')
+            return [session_id.strip() for session_id in separator.split(
+                self.config.get('experiment', 'sessions').strip()
+            ) if session_id.strip()]
+        return ['/'.join([
+            self.config.get('experiment', 'aggregation'),
+            self.config.get('experiment', 'graph'),
+            self.config.get('experiment', 'run')
+        ])]
+
+    def profile_handler(self, signum, stackframe):
+        """ start profiling the threads """
+        if self.profiler is None:
+            self.logger.warn("Got signal %s, profiler is not ready", signum)
+            return
+        self.profiler.request()
 
     def exit_program(self, exit_state):
-        self.gepoch.stop()
+        for session in self.sessions.values():
+            session.gossip_epoch.stop()
         time.sleep(3)
         sys.exit(1)
 
@@ -466,11 +1333,12 @@ class GossipDaemon(BaseDaemon):
             self.logger.error("no ip found on interface. Exiting...")
             raise Exception
 
-    def store_results(self, file_results):
+    def store_results(self, session):
         """ write the current to a file for later analysis
             In: (<time>,<state>)
             Out: <epoch>,<time>,<state>
         """
+        file_results = session.output_file
         if not os.path.isfile(file_results):
             self.logger.warn("output file does not exist... should have been created \
     during setup. Trying to recreate....")
@@ -483,7 +1351,7 @@ class GossipDaemon(BaseDaemon):
         try:
             with open(file_results, 'w') as f:
                 f.write("epoch,time,state\n")
-                for line in self.gstate.history:
+                for line in session.gossip_state.history:
                     f.write("%s\n" % ','.join(line))
         except (OSError, IOError):
             self.logger.error("Could not write state history.")
@@ -491,13 +1359,11 @@ class GossipDaemon(BaseDaemon):
 
     def prepare_threads(self, node_ip, dict_of_neighbours):
         """ initialize threads """
-        socks = {}
         passive_sock = GossipSocket(node_ip, self.config, self.logger)
         passive_thread = PassiveGossipThread(
             self.config,
             self.logger,
-            self.gstate,
-            self.gepoch,
+            self.sessions,
             passive_sock
         )
         active_sock = GossipSocket(node_ip, self.config, self.logger)
@@ -505,43 +1371,78 @@ class GossipDaemon(BaseDaemon):
             dict_of_neighbours,
             self.config,
             self.logger,
-            self.gstate,
-            self.gepoch,
+            self.sessions,
             active_sock
         )
+        if self.config.has_section('admission'):
+            passive_thread.admission = GossipAdmission(self.config,
+                self.logger)
+        if self.config.has_section('adaptive'):
+            active_thread.timing = GossipTiming(self.config, self.logger)
+        if self.config.has_section('hierarchy'):
+            hierarchy = GossipHierarchy(self.config, socket.gethostname(),
+                dict_of_neighbours, self.logger)
+            active_thread.hierarchy = hierarchy
+            passive_thread.hierarchy = hierarchy
+        if self.config.has_section('trace'):
+            tracer = GossipTracer(node_ip, self.logger)
+            active_thread.tracer = tracer
+            passive_thread.tracer = tracer
+        if self.config.has_option('collector', 'address'):
+            active_thread.reporter = GossipReporter(
+                socket.gethostname(),
+                self.config.get('collector', 'address'),
+                self.logger
+            )
         self.threads['passive'] = passive_thread
         self.threads['active'] = active_thread
 
     def run_threads(self, dict_of_neighbours):
         """ Starting active and passive thread """
+        for thread in self.threads.values():
+            thread.profiler = self.profiler
         self.threads['passive'].start()
         self.threads['active'].start()
-        self.threads['active'].join()
-        self.threads['passive'].join()
+        # join with a timeout, signals are not handled while join() blocks
+        for name in ['active', 'passive']:
+            while self.threads[name].is_alive():
+                if self.profiler:
+                    self.profiler.checkpoint('main')
+                self.threads[name].join(1)
 
-    def main(self):
-        def experiment_path():
-            return os.path.join(
-                self.config.get('experiment', 'aggregation'),
-                self.config.get('experiment', 'graph'),
-                self.config.get('experiment', 'run')
+    def start_epochs(self):
+        """ wait for the experiment start, shared by all sessions """
+        sessions = self.sessions.values()
+        sessions[0].gossip_epoch.start()
+        for session in sessions[1:]:
+            session.gossip_epoch.synchronise(
+                sessions[0].gossip_epoch.start_time
             )
 
+    def main(self):
         node_name = socket.gethostname()
 
         try:
-            output_file, log_file = self.generate_output_files(
-                self.config.get('paths', 'root_folder'),
-                experiment_path(),
-                node_name
-            )
+            for session in self.sessions.values():
+                session.output_file, session.log_file = \
+                    self.generate_output_files(
+                        self.config.get('paths', 'root_folder'),
+                        session.session_id,
+                        node_name
+                    )
         except:
             print "Could not generate output files :( Exiting..."
             sys.exit(1)
 
-        self.logger = self.create_logger(
-            self.config.get('logging', 'format'), log_file
-        )
+        for session in self.sessions.values():
+            self.logger = self.create_logger(
+                self.config.get('logging', 'format'), session.log_file,
+                SessionLogFilter(session.session_id)
+            )
+            if self.config.has_section('trace'):
+                session.trace_file = os.path.join(
+                    os.path.dirname(session.output_file), node_name + '.trace'
+                )
 
         try:
             node_ip = self.get_interface_ip_address(self.config.get(
@@ -556,17 +1457,31 @@ class GossipDaemon(BaseDaemon):
         dict_of_neighbours = self.read_file_of_neighbours(
             self.config.get('paths', 'list_of_neighbours_file')
         )
+        self.profiler = GossipProfiler(
+            self.config,
+            node_name,
+            os.path.dirname(self.sessions.values()[0].output_file),
+            self.sessions,
+            self.logger
+        )
         self.logger.debug("preparing threads and sockets")
         self.prepare_threads(node_ip, dict_of_neighbours)
         self.logger.debug("running threads")
         try:
-            self.gepoch.start()
+            self.start_epochs()
         except:
             self.logger.exception("could not start epochs")
         else:
             self.run_threads(dict_of_neighbours)
             self.logger.debug("storing results")
-            self.store_results(output_file)
+            if self.profiler:
+                self.profiler.checkpoint('main')
+            for session in self.sessions.values():
+                self.store_results(session)
+            if self.threads['active'].tracer:
+                self.threads['active'].tracer.close()
+            if self.profiler:
+                self.profiler.finish('main')
 
 if __name__ == '__main__':
     gossip_daemon = GossipDaemon()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""
+Title: Gossip statistics collector
+Author: Niklas Semmler
+Description: Collects the per-epoch states reported by the gossip daemons
+while the experiment runs and keeps cluster-wide running statistics.
+
+Every daemon with a [collector] section in its config sends one UDP datagram
+per session and epoch (see GossipReporter in gossip.py):
+
+    {"session": <aggregation>/<graph>/<run>, "node": <node>,
+     "epoch": <epoch>, "state": <state at the end of the epoch>}
+
+Epoch 0 carries the initial state, so its mean is the true mean all nodes
+should converge to. Mean and variance are kept with Welford's online
+algorithm, reports may arrive in any order.
+
+Live statistics:
+    GET http://<host>:<http port>/ => json of all sessions and epochs
+
+Output files:
+    <summary> => <session>,<epoch>,<count>,<mean>,<variance>,<min>,<max>,
+                 <rmse>,<max_error>
+
+Usage:
+> python gossip_collector.py -p 5003 -w 8080 -o summary.csv
+"""
+
+import sys
+import os
+import math
+import json
+import time
+import socket
+import signal
+import logging
+import argparse
+import threading
+import BaseHTTPServer
+
+
+class RunningStats(object):
+    """ count, mean, variance, min and max of a stream of values """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """ Welford update """
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def variance(self):
+        """ population variance """
+        if self.count == 0:
+            return 0.0
+        return self._m2 / self.count
+
+class GossipCollector(object):
+    """ running statistics per session and epoch """
+    def __init__(self, logger, epsilon=1e-3):
+        self._logger = logger
+        self._epsilon = epsilon
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def add(self, message):
+        """ account one report {'session', 'node', 'epoch', 'state'} """
+        key = (str(message['session']), int(message['epoch']))
+        state = float(message['state'])
+        with self._lock:
+            if key not in self._stats:
+                self._stats[key] = RunningStats()
+            self._stats[key].add(state)
+
+    def true_mean(self, session):
+        """ mean of the initial states, None until epoch 0 was reported """
+        stats = self._stats.get((session, 0))
+        if stats is None:
+            return None
+        return stats.mean
+
+    def summary(self):
+        """ {session: [{epoch, count, mean, ..., max_error}, ...]} """
+        summary = {}
+        with self._lock:
+            for (session, epoch) in sorted(self._stats):
+                stats = self._stats[(session, epoch)]
+                true_mean = self.true_mean(session)
+                line = {
+                    'epoch': epoch,
+                    'count': stats.count,
+                    'mean': stats.mean,
+                    'variance': stats.variance,
+                    'min': stats.min,
+                    'max': stats.max,
+                    'rmse': None,
+                    'max_error': None
+                }
+                if true_mean is not None:
+                    line['rmse'] = math.sqrt(
+                        stats.variance + (stats.mean - true_mean) ** 2)
+                    line['max_error'] = max(
+                        abs(stats.max - true_mean), abs(stats.min - true_mean))
+                summary.setdefault(session, []).append(line)
+        return summary
+
+    def converged(self):
+        """ first epoch per session whose rmse fell below epsilon times the
+            initial standard deviation
+        """
+        converged = {}
+        for session, lines in self.summary().items():
+            initial = math.sqrt(lines[0]['variance']) \
+                if lines[0]['epoch'] == 0 else None
+            converged[session] = None
+            for line in lines:
+                if initial is None or line['rmse'] is None:
+                    break
+                if line['rmse'] <= self._epsilon * initial:
+                    converged[session] = line['epoch']
+                    break
+        return converged
+
+    def store_summary(self, file_summary):
+        """ write all statistics to one file (replaced atomically) """
+        columns = ['epoch', 'count', 'mean', 'variance', 'min', 'max', 'rmse',
+            'max_error']
+        temp_file = file_summary + '.tmp'
+        try:
+            with open(temp_file, 'w') as f:
+                f.write("session,%s\n" % ','.join(columns))
+                summary = self.summary()
+                for session in sorted(summary):
+                    for line in summary[session]:
+                        f.write("%s,%s\n" % (session, ','.join(
+                            '' if line[c] is None else str(line[c])
+                            for c in columns)))
+            os.rename(temp_file, file_summary)
+        except (OSError, IOError):
+            self._logger.error("Could not write summary.")
+            raise
+
+class CollectorHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ serve the live statistics as json """
+    def do_GET(self):
+        body = json.dumps({
+            'sessions': self.server.collector.summary(),
+            'converged': self.server.collector.converged()
+        })
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        self.server.collector._logger.debug(format, *args)
+
+class CollectorDaemon(object):
+    def __init__(self):
+        self.logger = logging.getLogger()
+        parser = argparse.ArgumentParser(
+            description="Collects running statistics of gossip daemons")
+        parser.add_argument('-p', dest="port", type=int, required=True,
+            help="UDP port the daemons report to")
+        parser.add_argument('-w', dest="http_port", type=int, default=None,
+            help="HTTP port for live statistics")
+        parser.add_argument('-o', dest="summary", type=str, required=True,
+            help="summary file")
+        parser.add_argument('-i', dest="interval", type=float, default=10,
+            help="seconds between summary file updates")
+        parser.add_argument('-e', dest="epsilon", type=float, default=1e-3,
+            help="relative error counted as converged")
+        self.args = parser.parse_args()
+        self.collector = GossipCollector(self.logger, self.args.epsilon)
+        self.running = True
+        signal.signal(signal.SIGINT, self.signal_handler)
+        signal.signal(signal.SIGTERM, self.signal_handler)
+
+    def signal_handler(self, signum, stackframe):
+        """ stop and write the final summary """
+        self.logger.warn("Got signal %s!", signum)
+        self.running = False
+
+    def serve_http(self):
+        server = BaseHTTPServer.HTTPServer(('', self.args.http_port),
+            CollectorHandler)
+        server.collector = self.collector
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def main(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('', self.args.port))
+        sock.settimeout(1)
+        if self.args.http_port:
+            self.serve_http()
+        last_store = time.time()
+        while self.running:
+            try:
+                message, _ = sock.recvfrom(4096)
+                self.collector.add(json.loads(message))
+            except socket.timeout:
+                pass
+            except socket.error:
+                if self.running:
+                    raise
+            except (ValueError, KeyError, TypeError):
+                self.logger.warn("ill-formatted report %r", message)
+            if time.time() - last_store > self.args.interval:
+                self.collector.store_summary(self.args.summary)
+                last_store = time.time()
+        self.collector.store_summary(self.args.summary)
+        for session, epoch in sorted(self.collector.converged().items()):
+            if epoch is None:
+                print "%s did not converge" % session
+            else:
+                print "%s converged at epoch %s" % (session, epoch)
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)-15s [%(levelname)s] %(message)s")
+    collector_daemon = CollectorDaemon()
+    collector_daemon.main()
+    sys.exit(0)
@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+"""
+Title: Discrete-event simulation of the gossip daemon
+Author: Niklas Semmler
+Description: Simulates a whole cluster of gossip.py daemons on one heap of
+timed events, much faster than real time.
+
+Unlike R/simulation/gossip_simulate.py, which assumes synchronous rounds,
+every node runs the same steps as ActiveGossipThread and PassiveGossipThread:
+
+ActiveGossipThread (per epoch)
+    wait for the epoch start, move to the epoch of the clock (skipping the
+    epochs a late node missed), sleep randint(0, 100 * duration) / 100
+    seconds
+    acquire own lock
+    connect (timeout), send state, receive state (timeout)
+    update and release lock
+    on timeout or error: release lock
+
+PassiveGossipThread
+    accept (timeout), receive state (timeout)
+    acquire own lock, send state, update and release lock
+
+The active side gives up after the timeout while the passive side updates
+as soon as it got the request, so a late reply makes only one side update
+("one sided" exchanges) and the total mass of the cluster drifts.
+
+Messages take a latency drawn from a distribution, every loss adds a
+retransmission timeout that doubles for each further loss (like TCP).
+
+Distributions:
+    const:<value>
+    uniform:<low>,<high>
+    exp:<mean>
+    lognormal:<mu>,<sigma>
+
+Input files:
+    adjacency matrix as written by R/util/convert_to_adjmat.py
+    config file of the daemon ([epochs], [network] timeout, [threads])
+
+Output files:
+    <path>/<node>.csv => <epoch>,<time>,<state>
+
+Usage:
+> python gossip_eventsim.py -f config.ini -a test_graph -l exp:0.005 -p 0.01
+"""
+
+import sys
+import os
+import heapq
+import random
+import argparse
+import ConfigParser
+
+
+class Signal(object):
+    """ one-shot event processes can wait for """
+    def __init__(self):
+        self.fired = False
+        self.value = None
+        self.waiters = []
+
+class SimLock(object):
+    """ lock with a FIFO queue of waiting processes """
+    def __init__(self):
+        self.locked = False
+        self.waiters = []
+
+class Simulator(object):
+    """ heap of timed callbacks running generator based processes
+
+        A process is a generator yielding commands:
+        ('sleep', <seconds>)          => resumed with None
+        ('wait', <signal>, <timeout>) => resumed with (True, <value>) or
+                                         (False, None) after the timeout
+        ('acquire', <lock>)           => resumed once the lock is held
+    """
+    def __init__(self):
+        self.now = 0.0
+        self._queue = []
+        self._seq = 0
+
+    def schedule(self, delay, callback, *args):
+        """ call callback(*args) after delay seconds """
+        heapq.heappush(self._queue,
+            (self.now + max(delay, 0.0), self._seq, callback, args))
+        self._seq += 1
+
+    def process(self, generator):
+        """ start a process now """
+        self.schedule(0, self._step, generator, None)
+
+    def fire(self, signal, value=None):
+        """ fire signal and wake up everyone waiting for it """
+        if signal.fired:
+            return
+        signal.fired = True
+        signal.value = value
+        waiters, signal.waiters = signal.waiters, []
+        for token in waiters:
+            self._wake(token, (True, value))
+
+    def release(self, lock):
+        """ release lock, hand it to the next waiting process """
+        if lock.waiters:
+            self.schedule(0, self._step, lock.waiters.pop(0), None)
+        else:
+            lock.locked = False
+
+    def run(self, until=None):
+        """ process events until none are left (or until the given time) """
+        while self._queue:
+            if until is not None and self._queue[0][0] > until:
+                self.now = until
+                return
+            self.now, _, callback, args = heapq.heappop(self._queue)
+            callback(*args)
+
+    def _wake(self, token, value):
+        """ resume a waiting process exactly once """
+        if token[1]:
+            return
+        token[1] = True
+        self.schedule(0, self._step, token[0], value)
+
+    def _step(self, generator, value):
+        try:
+            command = generator.send(value)
+        except StopIteration:
+            return
+        if command[0] == 'sleep':
+            self.schedule(command[1], self._step, generator, None)
+        elif command[0] == 'wait':
+            signal, timeout = command[1], command[2]
+            if signal.fired:
+                self.schedule(0, self._step, generator, (True, signal.value))
+                return
+            token = [generator, False]
+            signal.waiters.append(token)
+            self.schedule(timeout, self._wake, token, (False, None))
+        elif command[0] == 'acquire':
+            lock = command[1]
+            if lock.locked:
+                lock.waiters.append(generator)
+            else:
+                lock.locked = True
+                self.schedule(0, self._step, generator, None)
+        else:
+            raise ValueError("unknown command %s" % command[0])
+
+def parse_distribution(spec, rng):
+    """ turn '<name>:<arguments>' into a function drawing samples """
+    name, _, arguments = spec.partition(':')
+    try:
+        params = [float(x) for x in arguments.split(',') if x]
+    except ValueError:
+        raise ValueError("ill-formatted distribution %s" % spec)
+    if name == 'const' and len(params) == 1:
+        return lambda: params[0]
+    elif name == 'uniform' and len(params) == 2:
+        return lambda: rng.uniform(params[0], params[1])
+    elif name == 'exp' and len(params) == 1:
+        return lambda: rng.expovariate(1.0 / params[0])
+    elif name == 'lognormal' and len(params) == 2:
+        return lambda: rng.lognormvariate(params[0], params[1])
+    raise ValueError("unknown distribution %s" % spec)
+
+def read_adjacency(file_adjacency):
+    """ neighbour indices per node from an adjacency matrix file """
+    neighbour_list = []
+    with open(file_adjacency, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = [int(float(x)) for x in line.strip().split(',')]
+            neighbour_list.append([i for i, x in enumerate(row) if x])
+    return neighbour_list
+
+class Connection(object):
+    """ one exchange as seen by both sides """
+    def __init__(self, active, passive):
+        self.active = active
+        self.passive = passive
+        self.request = Signal()
+        self.reply = Signal()
+        self.active_updated = False
+        self.passive_updated = False
+
+class SimNode(object):
+    """ state, lock and epoch of one simulated daemon """
+    def __init__(self, name, neighbours, initial_state):
+        self.name = name
+        self.neighbours = neighbours
+        self.state = initial_state
+        self.lock = SimLock()
+        self.epoch = 0
+        self.history = []
+        self.pending = []
+        self.incoming = Signal()
+        self.listening = True
+
+    def update(self, now, new_state):
+        """ aggregate like GossipState.update_and_release """
+        self.state = (self.state + new_state) / 2.0
+        self.history.append([str(self.epoch), str(now), str(self.state)])
+
+class GossipEventSim(object):
+    """ cluster of simulated daemons on one Simulator """
+    def __init__(self, neighbour_list, max_epoch=50, epoch_duration=4,
+            timeout=3, max_error=10, latency='const:0.001', loss=0.0,
+            rto=1.0, seed=None, initial_states=None):
+        self.rng = random.Random(seed)
+        if initial_states is None:
+            initial_states = [self.rng.randint(0, 1000) * 1.0
+                for neighbours in neighbour_list]
+        self.sim = Simulator()
+        self.max_epoch = max_epoch
+        self.epoch_duration = epoch_duration
+        self.timeout = timeout
+        self.max_error = max_error
+        self.latency = parse_distribution(latency, self.rng)
+        self.loss = loss
+        self.rto = rto
+        self.nodes = [
+            SimNode("Node%02d" % i, neighbours, initial_states[i])
+            for i, neighbours in enumerate(neighbour_list)
+        ]
+        self.initial_mass = sum(node.state for node in self.nodes)
+        self.connections = []
+        self.stats = {
+            'exchanges': 0, 'connect_timeouts': 0, 'reply_timeouts': 0,
+            'request_timeouts': 0, 'refused': 0, 'errors': 0,
+            'skipped_epochs': 0, 'lock_wait': 0.0
+        }
+
+    def delay(self):
+        """ one-way delay of a message including retransmissions """
+        delay = self.latency()
+        rto = self.rto
+        while self.loss and self.rng.random() < self.loss:
+            delay += rto
+            rto *= 2
+        return delay
+
+    def finished(self, node):
+        return node.epoch >= self.max_epoch
+
+    def acquire(self, node):
+        """ acquire a node's lock, accounting the time spent waiting """
+        start = self.sim.now
+        yield ('acquire', node.lock)
+        self.stats['lock_wait'] += self.sim.now - start
+
+    def exchange(self, node, outcome):
+        """ ActiveGossipThread.exchange, appends 'ok', 'timeout' or 'error'
+            to outcome
+        """
+        peer = self.nodes[self.rng.choice(node.neighbours)]
+        for command in self.acquire(node):
+            yield command
+        sent_state = node.state
+        # handshake
+        handshake = self.delay() + self.delay()
+        if handshake > self.timeout:
+            yield ('sleep', self.timeout)
+            self.stats['connect_timeouts'] += 1
+            self.sim.release(node.lock)
+            outcome.append('timeout')
+            return
+        yield ('sleep', handshake)
+        if not peer.listening:
+            self.stats['refused'] += 1
+            self.sim.release(node.lock)
+            outcome.append('error')
+            return
+        connection = Connection(node, peer)
+        self.connections.append(connection)
+        peer.pending.append(connection)
+        self.sim.fire(peer.incoming)
+        self.sim.schedule(self.delay(), self.sim.fire, connection.request,
+            sent_state)
+        received, new_state = yield ('wait', connection.reply, self.timeout)
+        if not received:
+            self.stats['reply_timeouts'] += 1
+            self.sim.release(node.lock)
+            outcome.append('timeout')
+            return
+        node.update(self.sim.now, new_state)
+        connection.active_updated = True
+        self.stats['exchanges'] += 1
+        self.sim.release(node.lock)
+        outcome.append('ok')
+
+    def active(self, node):
+        """ ActiveGossipThread.run for a single session """
+        error_count = 0
+        due = self.epoch_duration
+        while not self.finished(node):
+            yield ('sleep', due - self.sim.now)
+            # GossipEpoch.advance_to
+            epoch = max(node.epoch + 1,
+                int(self.sim.now // self.epoch_duration))
+            self.stats['skipped_epochs'] += epoch - node.epoch - 1
+            node.epoch = min(epoch, self.max_epoch)
+            due = (node.epoch + 1) * self.epoch_duration
+            if self.sim.now >= due:
+                continue
+            yield ('sleep', node.epoch * self.epoch_duration +
+                self.rng.randint(0, int(self.epoch_duration * 100)) / 100.0 -
+                self.sim.now)
+            outcome = []
+            process = self.exchange(node, outcome)
+            value = None
+            while True:
+                try:
+                    command = process.send(value)
+                except StopIteration:
+                    break
+                value = yield command
+            if outcome[0] == 'error':
+                error_count += 1
+                self.stats['errors'] += 1
+                if error_count >= self.max_error:
+                    node.epoch = self.max_epoch
+
+    def passive(self, node):
+        """ PassiveGossipThread.run for a single session """
+        while not self.finished(node):
+            if not node.pending:
+                node.incoming = Signal()
+                accepted, _ = yield ('wait', node.incoming, self.timeout)
+                if not accepted:
+                    continue
+            connection = node.pending.pop(0)
+            received, sent_state = yield ('wait', connection.request,
+                self.timeout)
+            if not received:
+                self.stats['request_timeouts'] += 1
+                continue
+            for command in self.acquire(node):
+                yield command
+            self.sim.schedule(self.delay(), self.sim.fire, connection.reply,
+                node.state)
+            node.update(self.sim.now, sent_state)
+            connection.passive_updated = True
+            self.sim.release(node.lock)
+        node.listening = False
+        node.pending = []
+
+    def run(self):
+        """ simulate the whole experiment, return statistics """
+        for node in self.nodes:
+            self.sim.process(self.active(node))
+            self.sim.process(self.passive(node))
+        self.sim.run()
+        stats = dict(self.stats)
+        stats['one_sided'] = sum(1 for c in self.connections
+            if c.active_updated != c.passive_updated)
+        stats['simulated_time'] = self.sim.now
+        stats['mass_drift'] = sum(node.state for node in self.nodes) - \
+            self.initial_mass
+        states = [node.state for node in self.nodes]
+        mean = self.initial_mass / len(self.nodes)
+        stats['max_error'] = max(abs(state - mean) for state in states)
+        return stats
+
+    def store_results(self, folder, start_time=0.0):
+        """ write <node>.csv files like GossipDaemon.store_results """
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        for node in self.nodes:
+            with open(os.path.join(folder, node.name + '.csv'), 'w') as f:
+                f.write("epoch,time,state\n")
+                for epoch, time, state in node.history:
+                    f.write("%s,%s,%s\n" % (
+                        epoch, float(time) + start_time, state))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Discrete-event simulation of gossip daemons")
+    parser.add_argument('-f', dest="configpath", type=str, required=True,
+        help="config file of the daemon")
+    parser.add_argument('-a', dest="adjacency", type=str, required=True,
+        help="adjacency matrix of the topology")
+    parser.add_argument('-l', dest="latency", type=str, default='const:0.001',
+        help="one-way latency distribution")
+    parser.add_argument('-p', dest="loss", type=float, default=0.0,
+        help="message loss probability")
+    parser.add_argument('-r', dest="rto", type=float, default=1.0,
+        help="initial retransmission timeout")
+    parser.add_argument('-s', dest="seed", type=int, default=None,
+        help="random seed")
+    parser.add_argument('-o', dest="output", type=str, default=None,
+        help="folder for the <node>.csv files")
+    args = parser.parse_args()
+
+    config = ConfigParser.RawConfigParser()
+    config.read(args.configpath)
+    simulation = GossipEventSim(
+        read_adjacency(args.adjacency),
+        max_epoch=int(config.get('epochs', 'max')),
+        epoch_duration=int(config.get('epochs', 'duration')),
+        timeout=float(config.get('network', 'timeout')),
+        max_error=int(config.get('threads', 'max_error')),
+        latency=args.latency,
+        loss=args.loss,
+        rto=args.rto,
+        seed=args.seed
+    )
+    stats = simulation.run()
+    for key in sorted(stats):
+        print "%s: %s" % (key, stats[key])
+    if args.output:
+        simulation.store_results(args.output)
+    sys.exit(0)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+'''
+Title: Shared fixtures of the gossip tests
+Author: Niklas Semmler
+Description: Configs, sessions and threads of nodes talking over loopback
+addresses (127.0.0.x), as used by testGossip.py and testGossipReplay.py.
+'''
+import random
+import ConfigParser
+import gossip
+
+
+def make_config(options):
+    """ build a config object from {section: {option: value}} """
+    config = ConfigParser.RawConfigParser()
+    for section, values in options.items():
+        config.add_section(section)
+        for option, value in values.items():
+            config.set(section, option, value)
+    return config
+
+def make_network_config(options=None):
+    """ config of a node with fresh ports plus the given sections """
+    # the send port of an earlier run may be in TIME_WAIT
+    recv_port = random.randrange(20000, 60000, 2)
+    sections = {
+        'threads': {'max_error': '10'},
+        'network': {'buf_size': '1024', 'timeout': '3',
+            'recv_port': str(recv_port), 'send_port': str(recv_port + 1)},
+    }
+    sections.update(options or {})
+    return make_config(sections)
+
+def make_session(logger, session_id, initial_state, start_time=0,
+        max_epoch=1000, epoch_dur=1):
+    g_epoch = gossip.GossipEpoch(logger, start_time, max_epoch, epoch_dur)
+    g_state = gossip.GossipState(logger, initial_state, g_epoch)
+    return gossip.GossipSession(session_id, g_state, g_epoch)
+
+def make_threads(config, logger, node_ip, sessions, neighbours=None):
+    """ passive and active thread of a node, not started """
+    passive = gossip.PassiveGossipThread(config, logger, sessions,
+        gossip.GossipSocket(node_ip, config, logger))
+    active = gossip.ActiveGossipThread(neighbours or {}, config, logger,
+        sessions, gossip.GossipSocket(node_ip, config, logger))
+    return passive, active
+
+def start_passive(passive):
+    """ start a passive thread, its socket listens once this returns """
+    passive.gossip_socket.listen()
+    passive.daemon = True
+    passive.start()
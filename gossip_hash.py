@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+"""
+Title: Content hashes of input files
+Author: Niklas Semmler
+Description: sha1 of a file's content, the key of the caches of
+gossip_spectral.py and gossip_topology.py. Standard library only, so the
+topology conversion does not load numpy/scipy.
+"""
+
+import hashlib
+
+
+def file_hash(path):
+    """ sha1 of a file's content """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
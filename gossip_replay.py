@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+"""
+Title: Deterministic replay of exchange traces
+Author: Niklas Semmler
+Description: Merges the exchange traces of all nodes of a run (see Tracing
+in gossip.py) and executes the exchanges again through the merge rule of
+GossipState, starting from the initial states in the trace headers. No
+sockets and no waiting, so a run of minutes replays in a fraction of a
+second.
+
+An exchange takes effect once both sides hold their state lock, so the
+exchanges are replayed in the order of the later of the two lock times.
+
+Both sides of an exchange are matched by the exchange id. Per exchange:
+    active ok, passive ok => both merge (REPLACE: the passive side takes over
+                             the active side's state)
+    only one side ok      => only that side merges ("one sided", the total
+                             mass changes)
+    busy, timeout, error  => nothing changes
+The replayed states are the states of the merge rule under test, not the
+recorded ones. "diverged" counts exchanges in which a node sent another
+state than the replay has for it. With the default rule and complete traces
+it is 0. Merges that change the total mass (sum of weight * state) by more
+than the tolerance are listed as violations.
+
+Input files:
+    <path>/<aggregation>/<graph>/<run>/<node>.trace
+
+Output files:
+    <output>/<node>.csv => <epoch>,<time>,<state> (replayed)
+
+Usage:
+> python gossip_replay.py divide_by_two/Iijs/1/ -o replay/
+> python gossip_replay.py divide_by_two/Iijs/1/ -r my_rules:MaxState
+"""
+
+import sys
+import os
+import glob
+import math
+import socket
+import logging
+import argparse
+import importlib
+
+import numpy
+
+import gossip
+
+Tracer = gossip.GossipTracer
+
+# numpy view of GossipTracer.RECORD
+TRACE_DTYPE = numpy.dtype([
+    ('xid', '<u8'),
+    ('epoch', '<u4'),
+    ('start', '<f8'),
+    ('end', '<f8'),
+    ('peer', 'S4'),
+    ('role', 'u1'),
+    ('outcome', 'u1'),
+    ('kind', 'u1'),
+    ('sent', '<f8'),
+    ('sent_weight', '<f8'),
+    ('received', '<f8'),
+    ('received_weight', '<f8')
+])
+
+
+def load_trace(file_trace):
+    """ node address, initial state and records of one trace file """
+    with open(file_trace, 'rb') as f:
+        data = f.read()
+    if len(data) < Tracer.HEADER.size:
+        raise ValueError("%s is not a trace" % file_trace)
+    magic, version, node_ip, initial = Tracer.HEADER.unpack_from(data)
+    if magic != Tracer.MAGIC or version != Tracer.VERSION:
+        raise ValueError("%s is not a version %s trace" % (file_trace,
+            Tracer.VERSION))
+    # a node killed while writing leaves an incomplete last record
+    count = (len(data) - Tracer.HEADER.size) // Tracer.RECORD.size
+    records = numpy.frombuffer(data, dtype=TRACE_DTYPE, count=count,
+        offset=Tracer.HEADER.size)
+    return socket.inet_ntoa(node_ip), initial, records
+
+def load_traces(paths):
+    """ {<node>: (<ip>, <initial state>, <records>)} of trace files and
+        folders of them
+    """
+    traces = {}
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(glob.glob(os.path.join(path, '*.trace')))
+        else:
+            files = [path]
+        for file_trace in files:
+            name = os.path.splitext(os.path.basename(file_trace))[0]
+            traces[name] = load_trace(file_trace)
+    return traces
+
+def finite(value):
+    return not math.isnan(value)
+
+class ReplayEpoch(object):
+    """ stands in for GossipEpoch, the replay sets the epoch """
+    def __init__(self):
+        self.curr_epoch = 0
+
+class GossipReplay(object):
+    """ replays merged traces through a GossipState class """
+    def __init__(self, traces, state_class=gossip.GossipState,
+            tolerance=1e-9, logger=None):
+        self.logger = logger or logging.getLogger("replay")
+        self.tolerance = tolerance
+        names = dict((ip, name) for name, (ip, initial, records)
+            in traces.items())
+        # xid => [active record, passive record] with (node, peer) added
+        exchanges = {}
+        for name, (ip, initial, records) in traces.items():
+            for record in records.tolist():
+                record = dict(zip(TRACE_DTYPE.names, record))
+                record['node'] = name
+                # numpy strips trailing zero bytes of the address
+                peer = socket.inet_ntoa(record['peer'].ljust(4, '\0'))
+                record['peer'] = names.get(peer, peer)
+                exchanges.setdefault(record['xid'], [None, None])[
+                    record['role']] = record
+        self.exchanges = sorted(exchanges.items(), key=lambda (xid, pair): (
+            max(record['start'] for record in pair if record), xid))
+        self.epoch = ReplayEpoch()
+        self.states = dict((name, state_class(self.logger, initial,
+            self.epoch)) for name, (ip, initial, records) in traces.items())
+        self.history = dict((name, []) for name in self.states)
+        self._weighted = set()
+
+    def mass(self, names=None):
+        """ sum of weight * state over the given (default all) nodes """
+        if names is None:
+            names = self.states.keys()
+        return sum(self.states[name].weight * self.states[name].current
+            for name in names if name in self.states)
+
+    def prepare(self, name, record, stats):
+        """ state and weight a node sends, compared to the recorded ones """
+        state = self.states[name]
+        if finite(record['sent_weight']) and name not in self._weighted:
+            # as GossipHierarchy.tag, the first weighted message sets it
+            self._weighted.add(name)
+            state.get_and_acquire()
+            state.reweight(record['sent_weight'])
+            state.release()
+        if finite(record['sent']) and \
+                abs(state.current - record['sent']) > self.tolerance:
+            stats['diverged'] += 1
+        weight = state.weight if finite(record['sent_weight']) else None
+        return state.current, weight
+
+    def apply(self, name, record, new_state, new_weight, kind):
+        """ merge (or take over) the peer's state """
+        state = self.states[name]
+        state.get_and_acquire()
+        if kind == Tracer.REPLACE:
+            state.replace_and_release(new_state)
+        else:
+            state.update_and_release(new_state, new_weight)
+        self.history[name].append([str(record['epoch']), str(record['end']),
+            str(state.current)])
+
+    def run(self):
+        """ replay all exchanges, returns statistics and violations """
+        stats = {'exchanges': len(self.exchanges), 'merged': 0,
+            'one_sided': 0, 'refused': 0, 'diverged': 0, 'violations': []}
+        stats['initial_mass'] = self.mass()
+        for xid, (active, passive) in self.exchanges:
+            active_ok = active is not None and active['outcome'] == Tracer.OK
+            passive_ok = passive is not None and \
+                passive['outcome'] == Tracer.OK
+            if not (active_ok or passive_ok):
+                stats['refused'] += 1
+                continue
+            record = active or passive
+            self.epoch.curr_epoch = record['epoch']
+            active_name = record['node'] if active else record['peer']
+            passive_name = record['peer'] if active else record['node']
+            if active_name not in self.states or \
+                    passive_name not in self.states:
+                self.logger.warn("exchange %s with an untraced node", xid)
+                continue
+            if active and passive and active_ok != passive_ok:
+                stats['one_sided'] += 1
+            # both sides send the state they have before the exchange
+            active_state, active_weight = self.prepare(active_name,
+                active or dict(passive, sent=passive['received'],
+                    sent_weight=passive['received_weight']), stats)
+            passive_state, passive_weight = self.prepare(passive_name,
+                passive or dict(active, sent=active['received'],
+                    sent_weight=active['received_weight']), stats)
+            before = self.mass([active_name, passive_name])
+            if active_ok and record['kind'] == Tracer.MERGE:
+                self.apply(active_name, active, passive_state,
+                    passive_weight, Tracer.MERGE)
+            if passive_ok:
+                self.apply(passive_name, passive, active_state,
+                    active_weight, record['kind'])
+            stats['merged'] += 1
+            delta = self.mass([active_name, passive_name]) - before
+            # pushing a result down does not keep the mass by design
+            if record['kind'] == Tracer.MERGE and \
+                    abs(delta) > self.tolerance * max(1.0, abs(before)):
+                stats['violations'].append({
+                    'xid': xid,
+                    'epoch': record['epoch'],
+                    'active': active_name,
+                    'passive': passive_name,
+                    'one_sided': active_ok != passive_ok,
+                    'delta': delta
+                })
+        stats['final_mass'] = self.mass()
+        return stats
+
+    def store_results(self, folder):
+        """ write the replayed histories like the daemon's output files """
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        for name, lines in self.history.items():
+            with open(os.path.join(folder, name + '.csv'), 'w') as f:
+                f.write("epoch,time,state\n")
+                for line in lines:
+                    f.write("%s\n" % ','.join(line))
+
+def load_state_class(spec):
+    """ GossipState subclass given as <module>:<class> """
+    module, sep, name = spec.partition(':')
+    if not sep:
+        raise ValueError("merge rule must be <module>:<class>")
+    return getattr(importlib.import_module(module), name)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay the exchange traces of a run")
+    parser.add_argument('paths', nargs='+',
+        help="trace files or folders with .trace files")
+    parser.add_argument('-r', dest="rule", type=str, default=None,
+        help="GossipState subclass with another merge rule, <module>:<class>")
+    parser.add_argument('-o', dest="output", type=str, default=None,
+        help="folder for the replayed state histories")
+    parser.add_argument('-t', dest="tolerance", type=float, default=1e-9,
+        help="mass change counted as violation")
+    args = parser.parse_args()
+
+    state_class = gossip.GossipState
+    if args.rule:
+        state_class = load_state_class(args.rule)
+    replay = GossipReplay(load_traces(args.paths), state_class,
+        args.tolerance)
+    stats = replay.run()
+    for key in ['exchanges', 'merged', 'one_sided', 'refused', 'diverged',
+            'initial_mass', 'final_mass']:
+        print "%s: %s" % (key, stats[key])
+    for violation in stats['violations']:
+        print "violation: exchange %(xid)s in epoch %(epoch)s, " \
+            "%(active)s -> %(passive)s, one sided: %(one_sided)s, " \
+            "mass change %(delta)s" % violation
+    if args.output:
+        replay.store_results(args.output)
+    sys.exit(1 if stats['violations'] else 0)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+"""
+Title: Run result loader
+Author: Niklas Semmler
+Description: Loads the per-node state histories of one or many runs into
+the "standard node evolution chart" of util.r as a numpy matrix, one row per
+node and one column per epoch (or per time bin):
+
+            epoch 1  epoch 2  epoch 3
+    Node00  20       25       32.5
+    Node01  40       40       32.5
+
+A node logs a line for every exchange, at its own times. The matrix holds
+the last state a node logged in each epoch (bin), epochs without an exchange
+keep the state of the epoch before, NaN before the first exchange. Every
+file is parsed with a single numpy call, the alignment is vectorized.
+
+Input files:
+    <root>/<aggregation>/<graph>/<run>[/<parameters>]/<node>.csv
+        => <epoch>,<time>,<state> (gossip.py, gossip_sweep.py,
+           gossip_eventsim.py)
+
+Cache:
+    <run folder>/.nodes.npz => matrix, keyed by the names, sizes and
+                               modification times of the node files and by
+                               the bin width
+
+Usage:
+> python gossip_results.py divide_by_two/ -e 0.01
+> python gossip_results.py divide_by_two/Reuna/1 -b 5
+"""
+
+import sys
+import os
+import glob
+import hashlib
+import argparse
+import multiprocessing
+
+import numpy
+
+CACHE_FILE = '.nodes.npz'
+
+
+def read_node_file(file_node):
+    """ epoch, time and state columns of one node file """
+    with open(file_node, 'r') as f:
+        f.readline()
+        body = f.read()
+    values = numpy.fromstring(body.replace('\n', ','), sep=',')
+    if len(values) % 3:
+        raise ValueError("%s is ill-formatted" % file_node)
+    values = values.reshape(-1, 3)
+    return values[:, 0], values[:, 1], values[:, 2]
+
+def node_files(folder, pattern='Node*.csv'):
+    """ node files of a run folder, sorted by node name """
+    return sorted(glob.glob(os.path.join(folder, pattern)))
+
+def align(node_index, columns, times, states, size, width):
+    """ node x column matrix of the last state per node and column,
+        forward filled
+    """
+    matrix = numpy.full((size, width), numpy.nan)
+    if len(states) == 0:
+        return matrix
+    order = numpy.lexsort((times, columns, node_index))
+    node_index = node_index[order]
+    columns = columns[order]
+    states = states[order]
+    last = numpy.ones(len(states), dtype=bool)
+    last[:-1] = (node_index[1:] != node_index[:-1]) | \
+        (columns[1:] != columns[:-1])
+    matrix[node_index[last], columns[last]] = states[last]
+    # index of the last column with a value, per cell
+    filled = numpy.where(numpy.isnan(matrix), 0,
+        numpy.arange(width)[numpy.newaxis, :])
+    filled = numpy.maximum.accumulate(filled, axis=1)
+    matrix = matrix[numpy.arange(size)[:, numpy.newaxis], filled]
+    return matrix
+
+def node_matrix(files, bin_width=None, start=None):
+    """ {'nodes', 'columns', 'states'} of node files
+        By epoch without bin_width, else by bins of bin_width seconds from
+        start (default: first logged time).
+        'columns' holds the epochs or the start times of the bins.
+    """
+    parsed = [read_node_file(file_node) for file_node in files]
+    nodes = [os.path.splitext(os.path.basename(f))[0] for f in files]
+    counts = [len(states) for epochs, times, states in parsed]
+    node_index = numpy.repeat(numpy.arange(len(files)), counts)
+    if parsed:
+        epochs, times, states = [numpy.concatenate(column)
+            for column in zip(*parsed)]
+    else:
+        epochs = times = states = numpy.zeros(0)
+    if bin_width is None:
+        first = int(epochs.min()) if len(epochs) else 1
+        columns = epochs.astype(int) - first
+        labels = numpy.arange(first, first + (columns.max() + 1
+            if len(columns) else 0))
+    else:
+        if start is None:
+            start = times.min() if len(times) else 0.0
+        columns = numpy.floor((times - start) / bin_width).astype(int)
+        keep = columns >= 0
+        node_index, columns, times, states = node_index[keep], \
+            columns[keep], times[keep], states[keep]
+        width = columns.max() + 1 if len(columns) else 0
+        labels = start + numpy.arange(width) * bin_width
+    states = align(node_index, columns, times, states, len(files),
+        len(labels))
+    return {'nodes': nodes, 'columns': labels, 'states': states}
+
+def cache_key(files, bin_width):
+    """ changes with any node file and with the bin width """
+    digest = hashlib.sha1(repr(bin_width))
+    for file_node in files:
+        stat = os.stat(file_node)
+        digest.update("%s,%s,%r\n" % (os.path.basename(file_node),
+            stat.st_size, stat.st_mtime))
+    return digest.hexdigest()
+
+def load_run(folder, bin_width=None, use_cache=True, pattern='Node*.csv'):
+    """ node matrix of a run folder, cached in the folder """
+    files = node_files(folder, pattern)
+    file_cache = os.path.join(folder, CACHE_FILE)
+    key = cache_key(files, bin_width)
+    if use_cache and os.path.isfile(file_cache):
+        try:
+            cache = numpy.load(file_cache)
+            if str(cache['key']) == key:
+                return {'nodes': list(cache['nodes']),
+                    'columns': cache['columns'], 'states': cache['states']}
+        except (IOError, ValueError, KeyError):
+            pass
+    run = node_matrix(files, bin_width)
+    if use_cache:
+        # keep the .npz extension, numpy.savez appends it otherwise
+        temp_file = "%s.%s.npz" % (file_cache[:-4], os.getpid())
+        try:
+            numpy.savez(temp_file, key=key, nodes=run['nodes'],
+                columns=run['columns'], states=run['states'])
+            os.rename(temp_file, file_cache)
+        except (IOError, OSError):
+            pass
+    return run
+
+def run_folders(root, pattern='Node*.csv'):
+    """ all folders below root (root included) with node files """
+    folders = []
+    for folder, sub_folders, names in os.walk(root):
+        sub_folders.sort()
+        if node_files(folder, pattern):
+            folders.append(folder)
+    return folders
+
+def _load_job(job):
+    folder, bin_width, use_cache = job
+    return folder, load_run(folder, bin_width, use_cache)
+
+def load_runs(root, bin_width=None, use_cache=True, processes=None):
+    """ {<run folder relative to root>: node matrix} of all runs below root
+    """
+    jobs = [(folder, bin_width, use_cache) for folder in run_folders(root)]
+    if processes == 1 or len(jobs) < 2:
+        results = map(_load_job, jobs)
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_load_job, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    return dict((os.path.relpath(folder, root), run)
+        for folder, run in results)
+
+def deviation(run):
+    """ standard deviation of the states per column (NaN ignored) """
+    states = numpy.ma.masked_invalid(run['states'])
+    return states.std(axis=0).filled(numpy.nan)
+
+def converged(run, epsilon=1e-3):
+    """ first column whose standard deviation fell below epsilon times the
+        one of the first column, None if it never did
+    """
+    std = deviation(run)
+    if len(std) == 0 or numpy.isnan(std[0]):
+        return None
+    below = numpy.nonzero(std <= epsilon * std[0])[0]
+    if len(below) == 0:
+        return None
+    return run['columns'][below[0]]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load run results into node x epoch matrices")
+    parser.add_argument('root', help="folder of one run or of many runs")
+    parser.add_argument('-b', dest="bin_width", type=float, default=None,
+        help="time bins of this many seconds instead of epochs")
+    parser.add_argument('-e', dest="epsilon", type=float, default=1e-3,
+        help="relative standard deviation counted as converged")
+    parser.add_argument('-j', dest="processes", type=int, default=None,
+        help="parallel processes (default: number of cores)")
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+        help="always parse the node files")
+    args = parser.parse_args()
+
+    runs = load_runs(args.root, args.bin_width, args.use_cache,
+        args.processes)
+    print "run,nodes,columns,first_std,last_std,converged"
+    for name in sorted(runs):
+        run = runs[name]
+        std = deviation(run)
+        print "%s,%d,%d,%s,%s,%s" % (
+            name,
+            len(run['nodes']),
+            len(run['columns']),
+            std[0] if len(std) else '',
+            std[-1] if len(std) else '',
+            '' if converged(run, args.epsilon) is None
+                else converged(run, args.epsilon)
+        )
+    sys.exit(0)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+"""
+Title: Spectral convergence predictor
+Author: Niklas Semmler
+Description: Predicts how fast push-pull gossip converges on a topology
+without simulating it.
+
+In one cycle every node i, in turn, picks a neighbour j with probability
+1/d_i and both replace their state by the average, as in
+R/simulation/gossip_simulate.py. A single exchange applies
+
+    W_ij = I - (e_i - e_j)(e_i - e_j)^T / 2
+
+The expected second moment M = E[(x - mean)(x - mean)^T] of the states
+therefore evolves linearly, node by node, as
+
+    M <- sum_j 1/d_i W_ij M W_ij
+
+and the spectral radius of one cycle of this map is the expected variance
+reduction factor per cycle ("rate"). epsilon is reached after
+log(epsilon) / log(rate) cycles. "first_cycle" is the reduction in the
+first cycle for independent identically distributed initial states.
+
+"bound" is the classic upper bound lambda_2(E[W]) ^ N with
+E[W] = I - L / (2N) and L the Laplacian of w_ij = 1/d_i + 1/d_j (S. Boyd,
+A. Ghosh, B. Prabhakar, D. Shah, "Randomized gossip algorithms", IEEE Trans.
+Inf. Theory, 2006).
+
+Counting is averaging with a single initial 1, so the same numbers apply.
+
+Input files:
+    adjacency matrix as written by R/util/convert_to_adjmat.py
+    (comma separated 0/1 rows)
+
+Cache:
+    <adjacency file>.spectral => json, keyed by the sha1 of the adjacency file
+
+Usage:
+> python gossip_spectral.py R/simulation/adjmat_ring -e 0.001
+"""
+
+import sys
+import os
+import math
+import json
+import argparse
+
+import numpy
+import scipy.sparse
+import scipy.sparse.linalg
+
+from gossip_hash import file_hash
+
+# below this many nodes the dense solver is faster than ARPACK
+DENSE_LIMIT = 200
+
+
+def load_adjacency(file_adjacency):
+    """ read adjacency matrix into a sparse symmetric matrix """
+    matrix = numpy.loadtxt(file_adjacency, delimiter=',', ndmin=2)
+    if matrix.shape[0] != matrix.shape[1]:
+        raise ValueError("adjacency matrix is not square")
+    matrix = (matrix != 0).astype(float)
+    matrix = numpy.maximum(matrix, matrix.T)
+    numpy.fill_diagonal(matrix, 0)
+    return scipy.sparse.csr_matrix(matrix)
+
+def exchange_laplacian(adjacency):
+    """ Laplacian of the edge weights w_ij = 1/d_i + 1/d_j """
+    adjacency = scipy.sparse.csr_matrix(adjacency)
+    degrees = numpy.asarray(adjacency.sum(axis=1)).ravel()
+    if (degrees == 0).any():
+        raise ValueError("graph has isolated nodes")
+    inv_degrees = scipy.sparse.diags(1.0 / degrees)
+    weights = inv_degrees * adjacency + adjacency * inv_degrees
+    row_sums = numpy.asarray(weights.sum(axis=1)).ravel()
+    return scipy.sparse.diags(row_sums) - weights
+
+def algebraic_connectivity(laplacian):
+    """ second smallest eigenvalue of a Laplacian """
+    size = laplacian.shape[0]
+    if size < 2:
+        return 0.0
+    if size <= DENSE_LIMIT:
+        eigenvalues = numpy.linalg.eigvalsh(laplacian.toarray())
+    else:
+        # shift-invert around a small negative value keeps the factorization
+        # regular while targeting the bottom of the spectrum
+        eigenvalues = scipy.sparse.linalg.eigsh(
+            scipy.sparse.csc_matrix(laplacian), k=2, sigma=-1e-3,
+            which='LM', return_eigenvectors=False
+        )
+    eigenvalues = numpy.sort(eigenvalues)
+    return max(float(eigenvalues[1]), 0.0)
+
+def neighbour_lists(adjacency):
+    """ list of neighbour indices for every node """
+    adjacency = scipy.sparse.csr_matrix(adjacency)
+    return [adjacency.indices[adjacency.indptr[i]:adjacency.indptr[i + 1]]
+        for i in xrange(adjacency.shape[0])]
+
+def cycle_second_moment(moment, neighbours):
+    """ expected second moment after one cycle of exchanges
+        (only the rows and columns of the exchanging nodes change)
+    """
+    moment = moment.copy()
+    for i, js in enumerate(neighbours):
+        prob = 1.0 / len(js)
+        rows = numpy.concatenate(([i], js))
+        # v^T M for v = e_i - e_j
+        diff = moment[i] - moment[js]
+        delta = numpy.empty((len(rows), moment.shape[0]))
+        delta[0] = prob * diff.sum(axis=0)
+        delta[1:] = -prob * diff
+        # v^T M v
+        quad = prob * (moment[i, i] - 2 * moment[i, js] + moment[js, js])
+        block = numpy.zeros((len(rows), len(rows)))
+        block[0, 0] = quad.sum()
+        block[0, 1:] = -quad
+        block[1:, 0] = -quad
+        block[1:, 1:] = numpy.diag(quad)
+        moment[rows, :] -= delta / 2
+        moment[:, rows] -= delta.T / 2
+        moment[numpy.ix_(rows, rows)] += block / 4
+    return moment
+
+def variance_rate(neighbours):
+    """ spectral radius of the second moment map of one cycle """
+    size = len(neighbours)
+
+    def centre(moment):
+        # symmetric and orthogonal to the consensus direction
+        moment = (moment + moment.T) / 2
+        moment = moment - moment.mean(axis=0)
+        return moment - moment.mean(axis=1)[:, numpy.newaxis]
+
+    def matvec(vector):
+        moment = centre(numpy.asarray(vector).reshape(size, size))
+        return centre(cycle_second_moment(moment, neighbours)).ravel()
+
+    if size < 3:
+        return 0.0
+    operator = scipy.sparse.linalg.LinearOperator(
+        (size * size, size * size), matvec=matvec, dtype=float
+    )
+    start = centre(numpy.identity(size)).ravel()
+    eigenvalues = scipy.sparse.linalg.eigs(
+        operator, k=1, which='LM', v0=start, return_eigenvectors=False
+    )
+    return float(abs(eigenvalues[0]))
+
+def predict(adjacency, epsilon=1e-3):
+    """ expected variance reduction per cycle and cycles until epsilon
+        Out: {'nodes', 'links', 'rate', 'first_cycle', 'bound', 'cycles'}
+    """
+    adjacency = scipy.sparse.csr_matrix(adjacency)
+    size = adjacency.shape[0]
+    neighbours = neighbour_lists(adjacency)
+    mu_2 = algebraic_connectivity(exchange_laplacian(adjacency))
+    if mu_2 <= 0:
+        raise ValueError("graph is not connected")
+    bound = math.exp(size * math.log(1.0 - mu_2 / (2.0 * size)))
+    rate = variance_rate(neighbours)
+    initial = numpy.identity(size) - 1.0 / size
+    first_cycle = numpy.trace(cycle_second_moment(initial, neighbours)) / \
+        numpy.trace(initial)
+    if rate > 0:
+        cycles = math.log(epsilon) / math.log(rate)
+    else:
+        cycles = 1.0
+    return {
+        'nodes': size,
+        'links': int(adjacency.nnz / 2),
+        'rate': rate,
+        'first_cycle': float(first_cycle),
+        'bound': bound,
+        'cycles': cycles
+    }
+
+def predict_file(file_adjacency, epsilon=1e-3, use_cache=True):
+    """ predict for an adjacency file, cached per graph and epsilon """
+    file_cache = file_adjacency + '.spectral'
+    key = "%s,%r" % (file_hash(file_adjacency), epsilon)
+    cache = {}
+    if use_cache and os.path.isfile(file_cache):
+        try:
+            with open(file_cache, 'r') as f:
+                cache = json.load(f)
+        except ValueError:
+            cache = {}
+        if key in cache:
+            return cache[key]
+    prediction = predict(load_adjacency(file_adjacency), epsilon)
+    if use_cache:
+        cache[key] = prediction
+        with open(file_cache, 'w') as f:
+            json.dump(cache, f)
+    return prediction
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Predict gossip convergence from the graph spectrum")
+    parser.add_argument('adjacency_files', nargs='+',
+        help="adjacency matrices as written by convert_to_adjmat.py")
+    parser.add_argument('-e', dest='epsilon', type=float, default=1e-3,
+        help="target variance reduction")
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+        help="always recompute")
+    args = parser.parse_args()
+
+    print "graph,nodes,links,rate,first_cycle,bound,cycles"
+    for file_adjacency in args.adjacency_files:
+        prediction = predict_file(file_adjacency, args.epsilon, args.use_cache)
+        print "%s,%d,%d,%0.4f,%0.4f,%0.4f,%0.1f" % (
+            file_adjacency,
+            prediction['nodes'],
+            prediction['links'],
+            prediction['rate'],
+            prediction['first_cycle'],
+            prediction['bound'],
+            prediction['cycles']
+        )
+    sys.exit(0)
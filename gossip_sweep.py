@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+"""
+Title: Experiment sweep scheduler
+Author: Niklas Semmler
+Description: Expands an experiment file (see load_exp.py) with lists of
+values into a grid of jobs and runs them concurrently.
+
+Every option may hold a comma separated list ("|" separated if the values
+contain commas, e.g. uniform:0.1,0.2 | exp:0.1), "runs" also accepts ranges:
+
+    [Graph]
+    name: Reuna, Geant2010
+
+    [Operation]
+    name: averaging, counting
+
+    [Run]
+    cycles: 40
+    runs: 1-10
+
+    [Parameters]
+    latency: exp:0.005, exp:0.05
+    loss: 0, 0.01
+
+    [Sweep]
+    mode: eventsim
+    topologies: topologies/
+    output: results/
+
+The grid is graphs x operations x runs x parameters. Modes:
+    simulate => synchronous rounds as in R/simulation/gossip_simulate.py,
+                takes no [Parameters]
+    eventsim => gossip_eventsim.GossipEventSim, [Parameters] are passed on
+    command  => runs [Sweep] command for every job (daemon runs), formatted
+                with {graph}, {operation}, {run}, {cycles}, {path}, {core},
+                {recv_port}, {send_port} and the parameters. At most one job
+                runs per core of [Sweep] cores, each gets its own pair of
+                ports from [Sweep] ports (e.g. 6000-6099).
+
+Simulations run in a process pool. The adjacency matrix of a graph is read
+from <topologies>/<graph>/adjmat (see gossip_topology.py).
+
+Output files:
+    <output>/<operation>/<graph>/<run>[/<parameters>]/<node>.csv
+    <output>/<operation>/<graph>/<run>[/<parameters>]/.done
+
+Jobs with a .done file are skipped, so an interrupted sweep resumes where it
+stopped.
+
+Usage:
+> python gossip_sweep.py example_sweep_file -j 4
+"""
+
+import sys
+import os
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+import subprocess
+import multiprocessing
+import Queue
+
+import load_exp
+import gossip_eventsim
+
+
+def expand_values(value):
+    """ '1, 2-4' => ['1', '2', '3', '4'] for ranges, else split at commas
+        (or at '|' if present)
+    """
+    values = []
+    separator = '|' if '|' in value else ','
+    for item in value.split(separator):
+        item = item.strip()
+        if not item:
+            continue
+        start, sep, end = item.partition('-')
+        if sep and start.isdigit() and end.isdigit():
+            values.extend(str(i) for i in xrange(int(start), int(end) + 1))
+        else:
+            values.append(item)
+    return values
+
+def parameter_key(params):
+    """ folder name of a parameter combination """
+    return ','.join("%s=%s" % (key, params[key]) for key in sorted(params))
+
+def expand_grid(exp_dict):
+    """ list of jobs for every combination of the experiment file """
+    sweep = exp_dict.get('Sweep', {})
+    graphs = expand_values(exp_dict['Graph']['name'])
+    operations = expand_values(exp_dict['Operation']['name'])
+    cycles = int(exp_dict['Run']['cycles'])
+    runs = expand_values(exp_dict['Run'].get('runs', '1'))
+    mode = sweep.get('mode', 'simulate')
+    if mode == 'simulate' and exp_dict.get('Parameters'):
+        raise ValueError("simulate mode takes no [Parameters]")
+    params_grid = [{}]
+    for key, value in sorted(exp_dict.get('Parameters', {}).items()):
+        params_grid = [dict(params, **{key: item})
+            for params in params_grid for item in expand_values(value)]
+
+    jobs = []
+    for operation in operations:
+        for graph in graphs:
+            for run in runs:
+                for params in params_grid:
+                    path = os.path.join(sweep.get('output', '.'),
+                        operation, graph, run)
+                    if params:
+                        path = os.path.join(path, parameter_key(params))
+                    jobs.append({
+                        'mode': mode,
+                        'graph': graph,
+                        'operation': operation,
+                        'run': run,
+                        'cycles': cycles,
+                        'params': params,
+                        'path': path,
+                        'adjacency': os.path.join(
+                            sweep.get('topologies', '.'), graph, 'adjmat')
+                    })
+    return jobs
+
+def job_seed(job):
+    """ reproducible seed per job, independent of the order of execution """
+    key = json.dumps([job['operation'], job['graph'], job['run'],
+        sorted(job['params'].items())])
+    return int(hashlib.sha1(key).hexdigest()[:8], 16)
+
+def initial_states(operation, size, rng):
+    """ counting starts with a single 1, averaging with random states """
+    if operation == 'counting':
+        return [1.0] + [0.0] * (size - 1)
+    return [rng.randint(0, 1000) * 1.0 for i in xrange(size)]
+
+def simulate(neighbour_list, cycles, states, rng):
+    """ synchronous rounds, returns the history of every node """
+    history = [[] for node in neighbour_list]
+    for cycle in xrange(1, cycles + 1):
+        for node in xrange(len(neighbour_list)):
+            dest = rng.choice(neighbour_list[node])
+            states[node] = states[dest] = (states[node] + states[dest]) / 2
+            history[node].append([str(cycle), str(cycle), str(states[node])])
+            history[dest].append([str(cycle), str(cycle), str(states[dest])])
+    return history
+
+def store_history(folder, history):
+    """ write <node>.csv files in the format of the daemon """
+    for i, lines in enumerate(history):
+        with open(os.path.join(folder, "Node%02d.csv" % i), 'w') as f:
+            f.write("epoch,time,state\n")
+            for line in lines:
+                f.write("%s\n" % ','.join(line))
+
+def mark_done(job, start):
+    with open(os.path.join(job['path'], '.done'), 'w') as f:
+        json.dump({'job': job, 'duration': time.time() - start}, f)
+
+def run_simulation(job):
+    """ run one simulate/eventsim job (in a worker process) """
+    start = time.time()
+    try:
+        if not os.path.isdir(job['path']):
+            os.makedirs(job['path'])
+        neighbour_list = gossip_eventsim.read_adjacency(job['adjacency'])
+        rng = random.Random(job_seed(job))
+        states = initial_states(job['operation'], len(neighbour_list), rng)
+        if job['mode'] == 'simulate':
+            store_history(job['path'],
+                simulate(neighbour_list, job['cycles'], states, rng))
+        else:
+            params = {}
+            for key, value in job['params'].items():
+                params[key] = value if key == 'latency' else float(value)
+            simulation = gossip_eventsim.GossipEventSim(neighbour_list,
+                max_epoch=job['cycles'], seed=job_seed(job),
+                initial_states=states, **params)
+            stats = simulation.run()
+            simulation.store_results(job['path'])
+            with open(os.path.join(job['path'], 'stats.json'), 'w') as f:
+                json.dump(stats, f)
+        mark_done(job, start)
+    except Exception as e:
+        # one broken job (e.g. a topology with an isolated node) must not
+        # stop the sweep
+        return job['path'], "failed: %s: %s" % (type(e).__name__, e)
+    return job['path'], 'done'
+
+class CommandRunner(object):
+    """ runs command jobs, one per core, each with its own pair of ports """
+    def __init__(self, command, cores, ports):
+        self.command = command
+        self.cores = Queue.Queue()
+        for core in cores:
+            self.cores.put(core)
+        self.ports = Queue.Queue()
+        port_list = expand_values(ports)
+        for i in xrange(0, len(port_list) - 1, 2):
+            self.ports.put((port_list[i], port_list[i + 1]))
+        self.slots = min(len(cores), self.ports.qsize())
+        if self.slots < 1:
+            raise ValueError("no cores or ports for command jobs")
+
+    def run(self, job):
+        start = time.time()
+        core = self.cores.get()
+        recv_port, send_port = self.ports.get()
+        try:
+            if not os.path.isdir(job['path']):
+                os.makedirs(job['path'])
+            fields = dict(job['params'], graph=job['graph'],
+                operation=job['operation'], run=job['run'],
+                cycles=job['cycles'], path=job['path'], core=core,
+                recv_port=recv_port, send_port=send_port)
+            with open(os.path.join(job['path'], 'command.log'), 'w') as log:
+                returncode = subprocess.call(self.command.format(**fields),
+                    shell=True, stdout=log, stderr=subprocess.STDOUT)
+            if returncode != 0:
+                return job['path'], "failed: exit code %s" % returncode
+            mark_done(job, start)
+            return job['path'], 'done'
+        except (IOError, OSError, KeyError) as e:
+            return job['path'], "failed: %s" % e
+        finally:
+            self.ports.put((recv_port, send_port))
+            self.cores.put(core)
+
+    def run_all(self, jobs, report):
+        """ run jobs on as many threads as there are slots """
+        pending = Queue.Queue()
+        for job in jobs:
+            pending.put(job)
+
+        def worker():
+            while True:
+                try:
+                    job = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                report(*self.run(job))
+
+        threads = [threading.Thread(target=worker)
+            for i in xrange(self.slots)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(1)
+
+def pending_jobs(jobs):
+    """ jobs without results """
+    return [job for job in jobs
+        if not os.path.isfile(os.path.join(job['path'], '.done'))]
+
+def run_sweep(exp_dict, processes=None, report=None):
+    """ run all jobs of the sweep that have no results yet """
+    if report is None:
+        report = lambda path, result: None
+    jobs = pending_jobs(expand_grid(exp_dict))
+    sweep = exp_dict.get('Sweep', {})
+    if sweep.get('mode', 'simulate') == 'command':
+        runner = CommandRunner(sweep['command'],
+            expand_values(sweep.get('cores', '0')),
+            sweep.get('ports', '5001-5002'))
+        runner.run_all(jobs, report)
+        return len(jobs)
+    pool = multiprocessing.Pool(processes)
+    try:
+        for path, result in pool.imap_unordered(run_simulation, jobs):
+            report(path, result)
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+    return len(jobs)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run an experiment sweep")
+    parser.add_argument('exp_file', help="experiment file with value lists")
+    parser.add_argument('-j', dest="processes", type=int, default=None,
+        help="parallel simulations (default: number of cores)")
+    parser.add_argument('-n', dest="dry_run", action='store_true',
+        help="only list the pending jobs")
+    args = parser.parse_args()
+
+    exp_dict = load_exp.parse_exp_file(args.exp_file)
+    if args.dry_run:
+        for job in pending_jobs(expand_grid(exp_dict)):
+            print job['path']
+        sys.exit(0)
+
+    def report(path, result):
+        print "%s: %s" % (path, result)
+        sys.stdout.flush()
+
+    try:
+        count = run_sweep(exp_dict, args.processes, report)
+    except KeyboardInterrupt:
+        print "interrupted, rerun to resume"
+        sys.exit(1)
+    print "%s jobs run" % count
+    sys.exit(0)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+"""
+Title: Batch topology conversion
+Author: Niklas Semmler
+Description: Converts a folder of Topology Zoo GraphML files into the inputs
+of the simulators and the daemons, in parallel and incrementally.
+
+Unlike R/util/convert_to_adjmat.py, the GraphML is read with the standard
+library's XML parser (no networkx/numpy) and every parsed graph is cached by
+the sha1 of the file content (see gossip_hash.py). A topology is
+only converted again when its GraphML changed, its neighbour lists are then
+written from scratch.
+
+Input files:
+    <source>/<Topology>.graphml
+
+Output files:
+    <dest>/<Topology>/adjmat => comma separated 0/1 rows (like
+                                convert_to_adjmat.py)
+    <dest>/<Topology>/neighbours/<node> => <name_of_host>,<ip_address_of_host>
+                                           (like example_neighbour_list)
+    <dest>/<Topology>/nodes => <node>,<ip_address>,<graphml label>
+    <dest>/<Topology>/.source => <sha1 of the GraphML>,<network>
+
+Cache:
+    <cache>/<sha1>.json => {"nodes": [[<id>, <label>], ...],
+                            "edges": [[<index>, <index>], ...]}
+
+Nodes are named Node00, Node01, ... in GraphML order and numbered from the
+first host address of the given network.
+
+Usage:
+> python gossip_topology.py zoo/ topologies/ -j 4 -n 10.0.0.0
+"""
+
+import sys
+import os
+import json
+import socket
+import struct
+import shutil
+import argparse
+import multiprocessing
+import xml.etree.cElementTree as ElementTree
+
+from gossip_hash import file_hash
+
+GRAPHML_NS = '{http://graphml.graphdrawing.org/xmlns}'
+
+
+def parse_graphml(file_graphml):
+    """ nodes ([id, label]) and undirected edges (index pairs) of a GraphML
+        file, without self loops and parallel edges
+    """
+    label_keys = set()
+    nodes = []
+    index = {}
+    edges = set()
+    for _, elem in ElementTree.iterparse(file_graphml):
+        tag = elem.tag.replace(GRAPHML_NS, '')
+        if tag == 'key' and elem.get('attr.name') == 'label' and \
+                elem.get('for') == 'node':
+            label_keys.add(elem.get('id'))
+        elif tag == 'node':
+            label = ''
+            for data in elem.findall(GRAPHML_NS + 'data'):
+                if data.get('key') in label_keys:
+                    label = data.text or ''
+            index[elem.get('id')] = len(nodes)
+            nodes.append([elem.get('id'), label])
+            elem.clear()
+        elif tag == 'edge':
+            try:
+                source = index[elem.get('source')]
+                target = index[elem.get('target')]
+            except KeyError:
+                raise ValueError("edge to unknown node in %s" % file_graphml)
+            if source != target:
+                edges.add((min(source, target), max(source, target)))
+            elem.clear()
+    return {'nodes': nodes, 'edges': sorted(edges)}
+
+def load_graph(file_graphml, digest, cache_folder):
+    """ parse a GraphML file or take it from the cache by its sha1 """
+    file_cache = os.path.join(cache_folder, digest + '.json')
+    if os.path.isfile(file_cache):
+        with open(file_cache, 'r') as f:
+            return json.load(f)
+    graph = parse_graphml(file_graphml)
+    temp_file = "%s.%s" % (file_cache, os.getpid())
+    with open(temp_file, 'w') as f:
+        json.dump(graph, f)
+    os.rename(temp_file, file_cache)
+    return graph
+
+def host_addresses(network, count):
+    """ the first count host addresses of an IPv4 network """
+    base = struct.unpack('!I', socket.inet_aton(network))[0]
+    return [socket.inet_ntoa(struct.pack('!I', base + i + 1))
+        for i in xrange(count)]
+
+def write_topology(graph, folder, network):
+    """ write adjacency matrix, neighbour lists and node table """
+    size = len(graph['nodes'])
+    names = ["Node%02d" % i for i in xrange(size)]
+    addresses = host_addresses(network, size)
+    neighbours = [[] for i in xrange(size)]
+    for source, target in graph['edges']:
+        neighbours[source].append(target)
+        neighbours[target].append(source)
+
+    # nodes of an earlier version of the topology must not stay behind
+    neighbour_folder = os.path.join(folder, 'neighbours')
+    if os.path.isdir(neighbour_folder):
+        shutil.rmtree(neighbour_folder)
+    os.makedirs(neighbour_folder)
+    with open(os.path.join(folder, 'adjmat'), 'w') as f:
+        for i in xrange(size):
+            row = ['0'] * size
+            for j in neighbours[i]:
+                row[j] = '1'
+            f.write("%s\n" % ','.join(row))
+    with open(os.path.join(folder, 'nodes'), 'w') as f:
+        for i in xrange(size):
+            f.write("%s,%s,%s\n" % (names[i], addresses[i],
+                graph['nodes'][i][1].encode('utf-8')))
+    for i in xrange(size):
+        with open(os.path.join(neighbour_folder, names[i]), 'w') as f:
+            for j in sorted(neighbours[i]):
+                f.write("%s,%s\n" % (names[j], addresses[j]))
+
+def convert(job):
+    """ convert one GraphML file unless its output is up to date
+        In: (<graphml file>, <dest folder>, <cache folder>, <network>)
+        Out: (<topology>, 'converted' | 'up to date' | <error message>)
+    """
+    file_graphml, dest_folder, cache_folder, network = job
+    name = os.path.splitext(os.path.basename(file_graphml))[0]
+    folder = os.path.join(dest_folder, name)
+    file_source = os.path.join(folder, '.source')
+    try:
+        digest = file_hash(file_graphml)
+        if os.path.isfile(file_source):
+            with open(file_source, 'r') as f:
+                if f.read().strip() == "%s,%s" % (digest, network):
+                    return name, 'up to date'
+        graph = load_graph(file_graphml, digest, cache_folder)
+        write_topology(graph, folder, network)
+        with open(file_source, 'w') as f:
+            f.write("%s,%s\n" % (digest, network))
+    except (IOError, OSError, ValueError, SyntaxError) as e:
+        return name, "failed: %s" % e
+    return name, 'converted'
+
+def convert_folder(source_folder, dest_folder, cache_folder=None,
+        network='10.0.0.0', processes=None):
+    """ convert every GraphML file of a folder, return {topology: result} """
+    if cache_folder is None:
+        cache_folder = os.path.join(dest_folder, '.cache')
+    if not os.path.isdir(cache_folder):
+        os.makedirs(cache_folder)
+    jobs = [
+        (os.path.join(source_folder, name), dest_folder, cache_folder, network)
+        for name in sorted(os.listdir(source_folder))
+        if name.lower().endswith('.graphml')
+    ]
+    if processes == 1 or len(jobs) < 2:
+        return dict(map(convert, jobs))
+    pool = multiprocessing.Pool(processes)
+    try:
+        return dict(pool.map(convert, jobs))
+    finally:
+        pool.close()
+        pool.join()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert a folder of GraphML topologies")
+    parser.add_argument('source', help="folder with .graphml files")
+    parser.add_argument('dest', help="output folder")
+    parser.add_argument('-c', dest="cache", type=str, default=None,
+        help="cache folder (default <dest>/.cache)")
+    parser.add_argument('-n', dest="network", type=str, default='10.0.0.0',
+        help="network the node addresses are taken from")
+    parser.add_argument('-j', dest="processes", type=int, default=None,
+        help="parallel processes (default: number of cores)")
+    args = parser.parse_args()
+
+    results = convert_folder(args.source, args.dest, args.cache,
+        args.network, args.processes)
+    failed = 0
+    for name in sorted(results):
+        print "%s: %s" % (name, results[name])
+        if results[name].startswith('failed'):
+            failed += 1
+    sys.exit(1 if failed else 0)
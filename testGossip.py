@@ -9,6 +9,382 @@ import gossip
 import random
 import socket
 import subprocess
+import logging
+import time
+import threading
+from gossip_fixtures import make_config, make_network_config, \
+    make_session, make_threads, start_passive
+
+class TestGossipSessions(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("test")
+        self.config = make_network_config()
+
+    def make_node(self, node_ip, neighbours, initial_states, start_time):
+        sessions = dict((session_id, make_session(self.logger, session_id,
+            initial_state, start_time, 2, 1))
+            for session_id, initial_state in initial_states.items())
+        return sessions, list(make_threads(self.config, self.logger,
+            node_ip, sessions, neighbours))
+
+    def start_node(self, threads):
+        passive, active = threads
+        start_passive(passive)
+        active.daemon = True
+        active.start()
+
+    def test_epoch_schedule(self):
+        g_epoch = gossip.GossipEpoch(self.logger, 100, 3, 4)
+        self.assertEqual(104, g_epoch.next_cycle_time)
+        g_epoch.advance()
+        self.assertEqual(1, g_epoch.curr_epoch)
+        self.assertEqual(108, g_epoch.next_cycle_time)
+        g_epoch.synchronise(200)
+        self.assertEqual(200, g_epoch.start_time)
+        self.assertEqual(208, g_epoch.next_cycle_time)
+
+    def test_sessions_are_kept_apart(self):
+        start_time = time.time()
+        sessions_a, threads_a = self.make_node("127.0.0.1",
+            {'b': "127.0.0.2"}, {'avg/x/1': 0.0, 'avg/x/2': 100.0},
+            start_time)
+        sessions_b, threads_b = self.make_node("127.0.0.2",
+            {'a': "127.0.0.1"}, {'avg/x/1': 10.0, 'avg/x/2': 200.0},
+            start_time)
+        self.start_node(threads_a)
+        self.start_node(threads_b)
+        for thread in threads_a + threads_b:
+            thread.join(30)
+        for sessions in (sessions_a, sessions_b):
+            for line in sessions['avg/x/1'].gossip_state.history:
+                self.assertTrue(0.0 <= float(line[2]) <= 10.0)
+            for line in sessions['avg/x/2'].gossip_state.history:
+                self.assertTrue(100.0 <= float(line[2]) <= 200.0)
+        self.assertTrue(sessions_a['avg/x/1'].gossip_state.history)
+        self.assertTrue(sessions_a['avg/x/2'].gossip_state.history)
+
+    def test_unknown_session(self):
+        sessions_a, (unused, active) = self.make_node("127.0.0.1",
+            {'b': "127.0.0.2"}, {'avg/x/1': 0.0}, 0)
+        sessions_b, (passive, unused) = self.make_node("127.0.0.2", {},
+            {'avg/x/2': 10.0}, 0)
+        start_passive(passive)
+        start = time.time()
+        with self.assertRaises(gossip.GossipBusy):
+            active.exchange(sessions_a['avg/x/1'])
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual([], sessions_a['avg/x/1'].gossip_state.history)
+        sessions_b['avg/x/2'].gossip_epoch.stop()
+
+    def test_session_logs(self):
+        root = logging.getLogger()
+        handlers = {}
+        for session_id in ['avg/x/1', 'avg/x/2']:
+            handler = logging.FileHandler(os.tempnam(), mode='w')
+            handler.addFilter(gossip.SessionLogFilter(session_id))
+            root.addHandler(handler)
+            handlers[session_id] = handler
+        level = root.level
+        root.setLevel(logging.DEBUG)
+        try:
+            logging.getLogger('session.avg/x/1').debug("line of 1")
+            logging.getLogger('session.avg/x/2').debug("line of 2")
+            root.debug("line of the daemon")
+        finally:
+            root.setLevel(level)
+            for handler in handlers.values():
+                root.removeHandler(handler)
+                handler.close()
+        for session_id, lines in [
+                ('avg/x/1', "line of 1\nline of the daemon\n"),
+                ('avg/x/2', "line of 2\nline of the daemon\n")]:
+            with open(handlers[session_id].baseFilename) as f:
+                self.assertEqual(lines, f.read())
+            os.remove(handlers[session_id].baseFilename)
+
+    def test_epochs_follow_wall_clock(self):
+        self.config.set('network', 'timeout', '0.5')
+        start_time = time.time() + 0.5
+        session_ids = ["avg/x/%s" % i for i in xrange(6)]
+        addresses = [("127.0.0.1", "127.0.0.2", 0.0),
+            ("127.0.0.2", "127.0.0.1", 10.0)]
+        nodes = [self.make_node(node_ip, {'other': other_ip},
+            dict((session_id, state) for session_id in session_ids),
+            start_time) for node_ip, other_ip, state in addresses]
+        for sessions, threads in nodes:
+            self.start_node(threads)
+        for sessions, (passive, active) in nodes:
+            active.join(30)
+        # epochs 1 and 2 end 3 seconds after the start, each session may
+        # run into a lock cycle and wait for the timeout once
+        lag = 0.5 * len(session_ids)
+        self.assertLess(time.time() - start_time, 3 + lag)
+        for sessions, threads in nodes:
+            for session in sessions.values():
+                for epoch, exchange_time, state in \
+                        session.gossip_state.history:
+                    # the history keeps times to 10 ms, a passive update
+                    # counts to the epoch its node is in
+                    offset = float(exchange_time) - start_time - int(epoch)
+                    self.assertTrue(-0.01 <= offset < 1 + lag, offset)
+
+class TestGossipTiming(unittest.TestCase):
+    def setUp(self):
+        self.config = make_config({
+            'network': {'timeout': '3'},
+            'adaptive': {'min_samples': '3', 'min_period': '0.5'},
+        })
+        self.timing = gossip.GossipTiming(self.config,
+            logging.getLogger("test"))
+
+    def test_percentile(self):
+        self.assertEqual(5, gossip.percentile(range(1, 11), 50))
+        self.assertEqual(10, gossip.percentile(range(1, 11), 99))
+        self.assertEqual(1, gossip.percentile([1], 0))
+
+    def test_timeout(self):
+        # static timeout until enough samples were measured
+        self.assertEqual(3, self.timing.timeout('a'))
+        for rtt in [0.01, 0.02, 0.03]:
+            self.timing.add_rtt('a', rtt)
+        self.assertAlmostEqual(0.1, self.timing.timeout('a'))
+        # neighbours without samples use those of all neighbours
+        self.assertAlmostEqual(0.1, self.timing.timeout('b'))
+        for rtt in [0.5, 0.6, 0.7]:
+            self.timing.add_rtt('b', rtt)
+        self.assertAlmostEqual(1.4, self.timing.timeout('b'))
+        # timeouts push the timeout up, but not beyond the configured one
+        for i in xrange(10):
+            self.timing.add_timeout('b')
+        self.assertEqual(3, self.timing.timeout('b'))
+
+    def test_slots(self):
+        self.assertEqual(1, self.timing.slots(4))
+        for duration in [0.3, 0.3, 0.4]:
+            self.timing.add_duration(duration)
+        self.assertEqual(5, self.timing.slots(4))
+        for duration in [3, 3, 3]:
+            self.timing.add_duration(duration)
+        self.assertEqual(1, self.timing.slots(4))
+
+class TestGossipAdmission(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("test")
+        self.config = make_network_config({
+            'admission': {'max_concurrent': '1', 'lock_wait': '0.1'},
+        })
+
+    def start_nodes(self):
+        """ a (0.0) exchanges with b (10.0), which admits one exchange """
+        sessions_a = {'s': make_session(self.logger, 's', 0.0)}
+        sessions_b = {'s': make_session(self.logger, 's', 10.0)}
+        passive, unused = make_threads(self.config, self.logger,
+            "127.0.0.2", sessions_b)
+        passive.admission = gossip.GossipAdmission(self.config, self.logger)
+        start_passive(passive)
+        unused, active = make_threads(self.config, self.logger, "127.0.0.1",
+            sessions_a, {'b': "127.0.0.2"})
+        return sessions_a, sessions_b, passive, active
+
+    def test_budget(self):
+        admission = gossip.GossipAdmission(self.config, self.logger)
+        served = threading.Event()
+        release = threading.Event()
+
+        def serve(connection):
+            served.set()
+            release.wait(3)
+
+        connection = FakeConnection()
+        self.assertTrue(admission.admit(connection, serve))
+        served.wait(3)
+        self.assertFalse(admission.admit(FakeConnection(), serve))
+        release.set()
+        time.sleep(0.1)
+        self.assertTrue(connection.closed)
+        self.assertTrue(admission.admit(FakeConnection(), lambda c: None))
+
+    def test_busy_neighbour(self):
+        sessions_a, sessions_b, passive, active = self.start_nodes()
+
+        # b is in the middle of its own exchange
+        sessions_b['s'].gossip_state.get_and_acquire()
+        with self.assertRaises(gossip.GossipBusy):
+            active.exchange(sessions_a['s'])
+        sessions_b['s'].gossip_state.release()
+        self.assertEqual([], sessions_a['s'].gossip_state.history)
+
+        active.exchange(sessions_a['s'])
+        self.assertEqual(5.0, sessions_a['s'].gossip_state.current)
+        time.sleep(0.2)
+        self.assertEqual(5.0, sessions_b['s'].gossip_state.current)
+        sessions_b['s'].gossip_epoch.stop()
+
+    def test_silent_peer(self):
+        sessions_a, sessions_b, passive, active = self.start_nodes()
+
+        # one peer takes the budget, another one is over budget, neither
+        # sends a request
+        silent = [socket.create_connection(
+            ("127.0.0.2", passive.gossip_socket.recv_port))
+            for i in xrange(2)]
+        time.sleep(0.1)
+        start = time.time()
+        with self.assertRaises(gossip.GossipBusy):
+            active.exchange(sessions_a['s'])
+        self.assertLess(time.time() - start, 1)
+        for sock in silent:
+            sock.close()
+        sessions_b['s'].gossip_epoch.stop()
+
+class TestGossipProfiler(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("test")
+        self.folder = os.tempnam()
+        os.makedirs(self.folder)
+        self.sessions = {'s': make_session(self.logger, 's', 0.0)}
+
+    def tearDown(self):
+        for name in os.listdir(self.folder):
+            os.remove(os.path.join(self.folder, name))
+        os.rmdir(self.folder)
+
+    def profile(self, mode):
+        config = make_config({'profiling': {'mode': mode, 'window': '0.3',
+            'interval': '0.01'}})
+        profiler = gossip.GossipProfiler(config, 'n1', self.folder,
+            self.sessions, self.logger)
+
+        def work():
+            for i in xrange(20):
+                profiler.checkpoint('active')
+                time.sleep(0.03)
+            profiler.finish('active')
+
+        profiler.checkpoint('active')
+        profiler.request()
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join(5)
+        time.sleep(0.1)
+        return os.listdir(self.folder)
+
+    def test_deterministic(self):
+        self.assertEqual(['n1_active_epoch0.prof'], self.profile(
+            'deterministic'))
+
+    def test_sampling(self):
+        self.assertEqual(['n1_active_epoch0.stacks'], self.profile(
+            'sampling'))
+        with open(os.path.join(self.folder, 'n1_active_epoch0.stacks')) as f:
+            self.assertIn('work', f.read())
+
+class TestGossipHierarchy(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("test")
+        self.file_groups = os.tempnam()
+        with open(self.file_groups, 'w') as f:
+            f.write("a1,127.0.0.1,A\nb2,127.0.0.3,B\nb1,127.0.0.2,B\n")
+        self.config = make_network_config({
+            'hierarchy': {'groups': self.file_groups, 'local_epochs': '1',
+                'global_epochs': '1'},
+        })
+
+    def tearDown(self):
+        os.remove(self.file_groups)
+
+    def make_node(self, name, node_ip, initial_state):
+        hierarchy = gossip.GossipHierarchy(self.config, name, {},
+            self.logger)
+        session = make_session(self.logger, 's', initial_state)
+        passive, active = make_threads(self.config, self.logger, node_ip,
+            {'s': session})
+        passive.hierarchy = active.hierarchy = hierarchy
+        start_passive(passive)
+        return session, active
+
+    def test_groups(self):
+        hierarchy = gossip.GossipHierarchy(self.config, 'b2',
+            {'a1': "127.0.0.1"}, self.logger)
+        self.assertEqual('B', hierarchy.group)
+        self.assertEqual(2, hierarchy.size)
+        self.assertFalse(hierarchy.is_representative)
+        self.assertEqual({'b1': "127.0.0.2"}, hierarchy.local_neighbours)
+        hierarchy = gossip.GossipHierarchy(self.config, 'b1', {},
+            self.logger)
+        self.assertTrue(hierarchy.is_representative)
+        self.assertEqual({'a1': "127.0.0.1"}, hierarchy.other_representatives)
+
+    def test_weighted_update(self):
+        g_epoch = gossip.GossipEpoch(self.logger, 0, 10, 1)
+        g_state = gossip.GossipState(self.logger, 15.0, g_epoch)
+        g_state.get_and_acquire()
+        g_state.reweight(2.0)
+        self.assertEqual(10.0, g_state.update_and_release(0.0, 1.0))
+        self.assertEqual(1.5, g_state.weight)
+
+    def test_tiers(self):
+        nodes = [self.make_node('a1', "127.0.0.1", 0.0),
+            self.make_node('b1', "127.0.0.2", 10.0),
+            self.make_node('b2', "127.0.0.3", 20.0)]
+        (a1, active_a1), (b1, active_b1), (b2, active_b2) = nodes
+
+        def advance():
+            for session, active in nodes:
+                session.gossip_epoch.advance()
+
+        advance()
+        # b1 and b2 agree on the group mean, a1 has no group members
+        active_b2.exchange(b2)
+        active_a1.exchange(a1)
+        time.sleep(0.2)
+        self.assertEqual(15.0, b1.gossip_state.current)
+        a1.gossip_epoch.advance()
+        b1.gossip_epoch.advance()
+        # an exchange of a late member is refused in the global tier
+        with self.assertRaises(gossip.GossipBusy):
+            active_b2.exchange(b2)
+        b2.gossip_epoch.advance()
+        self.assertEqual({}, active_b2.hierarchy.neighbours(b2))
+        # mean of the group aggregates weighted by the group sizes
+        active_b1.exchange(b1)
+        time.sleep(0.2)
+        self.assertEqual(10.0, b1.gossip_state.current)
+        self.assertEqual(10.0, a1.gossip_state.current)
+        self.assertEqual(1.5, a1.gossip_state.weight)
+        advance()
+        active_b2.exchange(b2)
+        active_b1.exchange(b1)
+        time.sleep(0.2)
+        self.assertEqual(10.0, b2.gossip_state.current)
+        self.assertEqual([], active_b1.hierarchy.neighbours(b1).keys())
+        for session, active in nodes:
+            session.gossip_epoch.stop()
+
+    def test_push_down_skips_failing_members(self):
+        nodes = [self.make_node('a1', "127.0.0.1", 0.0),
+            self.make_node('b1', "127.0.0.2", 10.0),
+            self.make_node('b2', "127.0.0.3", 20.0)]
+        (a1, active_a1), (b1, active_b1), (b2, active_b2) = nodes
+        a1.gossip_epoch.advance()
+        for session in [b1, b2]:
+            for i in xrange(3):
+                session.gossip_epoch.advance()
+        # a1 answers busy (other tier), nobody listens at 127.0.0.9
+        active_b1.push_down(b1, {'a0': "127.0.0.1", 'b0': "127.0.0.9",
+            'b2': "127.0.0.3"})
+        time.sleep(0.2)
+        self.assertEqual(10.0, b2.gossip_state.current)
+        self.assertEqual({}, active_b1.hierarchy.neighbours(b1))
+        for session, active in nodes:
+            session.gossip_epoch.stop()
+
+class FakeConnection(object):
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
 
 class TestGossip(unittest.TestCase):
     def setUp(self):
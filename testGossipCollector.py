@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+'''
+Title: Tests for the statistics collector
+Author: Niklas Semmler
+'''
+import unittest
+import os
+import json
+import random
+import socket
+import logging
+import time
+import gossip
+import gossip_collector
+from gossip_fixtures import make_network_config, make_session, \
+    make_threads, start_passive
+
+class RecordingReporter(object):
+    """ keeps the reports instead of sending them """
+    def __init__(self, node_name):
+        self.node_name = node_name
+        self.reports = []
+
+    def report(self, session):
+        self.reports.append((self.node_name, session.session_id,
+            session.gossip_epoch.curr_epoch))
+
+class TestGossipCollector(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("test")
+        self.collector = gossip_collector.GossipCollector(self.logger, 0.01)
+
+    def test_running_stats(self):
+        values = [random.uniform(-100, 100) for i in xrange(1000)]
+        stats = gossip_collector.RunningStats()
+        for value in values:
+            stats.add(value)
+        mean = sum(values) / len(values)
+        variance = sum((v - mean) ** 2 for v in values) / len(values)
+        self.assertEqual(1000, stats.count)
+        self.assertAlmostEqual(mean, stats.mean)
+        self.assertAlmostEqual(variance, stats.variance)
+        self.assertEqual(min(values), stats.min)
+        self.assertEqual(max(values), stats.max)
+
+    def test_summary_out_of_order(self):
+        reports = [
+            ('s', 1, 'a', 15.0), ('s', 0, 'a', 10.0), ('s', 1, 'b', 15.0),
+            ('s', 0, 'b', 20.0), ('s', 2, 'a', 15.0)
+        ]
+        for session, epoch, node, state in reports:
+            self.collector.add({'session': session, 'epoch': epoch,
+                'node': node, 'state': state})
+        summary = self.collector.summary()['s']
+        self.assertEqual([0, 1, 2], [line['epoch'] for line in summary])
+        self.assertEqual(15.0, summary[0]['mean'])
+        self.assertEqual(5.0, summary[0]['rmse'])
+        self.assertEqual(5.0, summary[0]['max_error'])
+        self.assertEqual(0.0, summary[1]['rmse'])
+        self.assertEqual({'s': 1}, self.collector.converged())
+
+        file_summary = os.tempnam()
+        self.collector.store_summary(file_summary)
+        with open(file_summary, 'r') as f:
+            lines = f.readlines()
+        self.assertEqual(4, len(lines))
+        self.assertEqual("s,0,2,15.0,25.0,10.0,20.0,5.0,5.0\n", lines[1])
+        os.remove(file_summary)
+
+    def test_reporter(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        sock.settimeout(3)
+        g_epoch = gossip.GossipEpoch(self.logger, 0, 3, 1)
+        g_state = gossip.GossipState(self.logger, 42.0, g_epoch)
+        session = gossip.GossipSession('avg/x/1', g_state, g_epoch)
+        reporter = gossip.GossipReporter('Node01',
+            "127.0.0.1:%s" % sock.getsockname()[1], self.logger)
+        reporter.report(session)
+        message = json.loads(sock.recv(4096))
+        self.assertEqual({'session': 'avg/x/1', 'node': 'Node01',
+            'epoch': 0, 'state': 42.0}, message)
+        sock.close()
+
+    def test_one_report_per_epoch(self):
+        config = make_network_config()
+        config.set('network', 'timeout', '0.5')
+        start_time = time.time() + 0.5
+        nodes = []
+        for name, node_ip, other_ip in [('a', "127.0.0.1", "127.0.0.2"),
+                ('b', "127.0.0.2", "127.0.0.1")]:
+            sessions = {'s': make_session(self.logger, 's', 0.0, start_time,
+                2, 1)}
+            passive, active = make_threads(config, self.logger, node_ip,
+                sessions, {'other': other_ip})
+            active.reporter = RecordingReporter(name)
+            start_passive(passive)
+            active.daemon = True
+            active.start()
+            nodes.append(active)
+        for active in nodes:
+            active.join(30)
+            self.assertEqual([(active.reporter.node_name, 's', epoch)
+                for epoch in [0, 1, 2]], active.reporter.reports)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+'''
+Title: Tests for the discrete-event simulation
+Author: Niklas Semmler
+'''
+import unittest
+import os
+import random
+import gossip_eventsim
+
+class TestSimulator(unittest.TestCase):
+    def setUp(self):
+        self.sim = gossip_eventsim.Simulator()
+        self.trace = []
+
+    def test_sleep_and_wait(self):
+        signal = gossip_eventsim.Signal()
+
+        def waiter(timeout):
+            result = yield ('wait', signal, timeout)
+            self.trace.append((self.sim.now, timeout, result))
+
+        self.sim.process(waiter(1))
+        self.sim.process(waiter(5))
+        self.sim.schedule(2, self.sim.fire, signal, 'x')
+        self.sim.run()
+        self.assertEqual([(1, 1, (False, None)), (2, 5, (True, 'x'))],
+            self.trace)
+
+    def test_lock(self):
+        lock = gossip_eventsim.SimLock()
+
+        def worker(name, hold):
+            yield ('acquire', lock)
+            self.trace.append((name, self.sim.now))
+            yield ('sleep', hold)
+            self.sim.release(lock)
+
+        self.sim.process(worker('a', 2))
+        self.sim.process(worker('b', 1))
+        self.sim.process(worker('c', 1))
+        self.sim.run()
+        self.assertEqual([('a', 0), ('b', 2), ('c', 3)], self.trace)
+        self.assertFalse(lock.locked)
+
+class TestGossipEventSim(unittest.TestCase):
+    def setUp(self):
+        self.neighbour_list = gossip_eventsim.read_adjacency('test_graph')
+
+    def test_parse_distribution(self):
+        rng = random.Random(1)
+        self.assertEqual(0.5, gossip_eventsim.parse_distribution(
+            'const:0.5', rng)())
+        sample = gossip_eventsim.parse_distribution('uniform:1,2', rng)()
+        self.assertTrue(1 <= sample <= 2)
+        with self.assertRaises(ValueError):
+            gossip_eventsim.parse_distribution('pareto:1', rng)
+        with self.assertRaises(ValueError):
+            gossip_eventsim.parse_distribution('exp:x', rng)
+
+    def test_mass_conserved_without_contention(self):
+        simulation = gossip_eventsim.GossipEventSim([[1], [0]],
+            max_epoch=1, seed=0)
+        stats = simulation.run()
+        self.assertEqual(2, stats['exchanges'])
+        self.assertEqual(0, stats['one_sided'])
+        self.assertAlmostEqual(0, stats['mass_drift'], places=6)
+
+    def test_lock_cycles_end_in_timeouts(self):
+        # the active thread holds its lock while waiting for the neighbour,
+        # the latency keeps that window open long enough for a cycle
+        simulation = gossip_eventsim.GossipEventSim(self.neighbour_list,
+            max_epoch=10, latency='const:0.1', timeout=1000, seed=1)
+        stats = simulation.run()
+        self.assertTrue(stats['reply_timeouts'] > 0)
+        self.assertTrue(stats['simulated_time'] > 1000)
+
+    def test_timeouts_make_exchanges_one_sided(self):
+        simulation = gossip_eventsim.GossipEventSim(self.neighbour_list,
+            max_epoch=10, latency='uniform:0.5,2', timeout=1.5, seed=1)
+        stats = simulation.run()
+        self.assertTrue(stats['one_sided'] > 0)
+
+    def test_store_results(self):
+        folder = os.tempnam()
+        simulation = gossip_eventsim.GossipEventSim(self.neighbour_list,
+            max_epoch=3, seed=1)
+        simulation.run()
+        simulation.store_results(folder)
+        with open(os.path.join(folder, 'Node00.csv'), 'r') as f:
+            self.assertEqual("epoch,time,state\n", f.readline())
+            self.assertEqual(3, len(f.readline().split(',')))
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+'''
+Title: Tests for the trace replay
+Author: Niklas Semmler
+'''
+import unittest
+import os
+import logging
+import time
+import gossip
+import gossip_replay
+from gossip_fixtures import make_config, make_network_config, \
+    make_session, make_threads, start_passive
+
+Tracer = gossip.GossipTracer
+
+
+class MaxState(gossip.GossipState):
+    """ merge rule keeping the maximum """
+    def merge(self, state, weight, new_state, new_weight):
+        return max(state, new_state), weight
+
+class BrokenTracer(object):
+    """ fails like a trace file that cannot be written """
+    def record(self, *args):
+        raise IOError("disk full")
+
+class OneMessage(object):
+    """ accepted connection with one request """
+    def __init__(self, message):
+        self.message = message
+        self.address = "10.0.0.1"
+
+    def recv(self):
+        return self.message
+
+    def send(self, data):
+        pass
+
+class TestGossipReplay(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("test")
+        self.folder = os.tempnam()
+        os.makedirs(self.folder)
+
+    def tearDown(self):
+        for name in os.listdir(self.folder):
+            os.remove(os.path.join(self.folder, name))
+        os.rmdir(self.folder)
+
+    def make_session(self, name, initial_state):
+        session = make_session(self.logger, 's', initial_state)
+        session.trace_file = os.path.join(self.folder, name + '.trace')
+        return session
+
+    def record(self, tracers, sessions, xid, start, states, outcomes,
+            weights=(None, None), passive_start=None):
+        """ both sides of an exchange of sessions a (active) and b """
+        messages = []
+        for state, weight in zip(states, weights):
+            message = {'session': 's', 'state': state}
+            if weight is not None:
+                message['weight'] = weight
+            messages.append(message)
+        tracers[0].record(sessions[0], xid, Tracer.ACTIVE, outcomes[0], start,
+            tracers[1].node_ip, messages[0], messages[1])
+        tracers[1].record(sessions[1], xid, Tracer.PASSIVE, outcomes[1],
+            passive_start or start, tracers[0].node_ip, messages[1],
+            messages[0])
+
+    def write_traces(self):
+        tracers = [Tracer("10.0.0.1", self.logger),
+            Tracer("10.0.0.2", self.logger), Tracer("10.0.0.3", self.logger)]
+        a, b, c = [self.make_session(name, state)
+            for name, state in zip('abc', [0.0, 8.0, 6.0])]
+        self.record([tracers[0], tracers[1]], [a, b], 1, 1.0, [0.0, 8.0],
+            [Tracer.OK, Tracer.OK])
+        self.record([tracers[1], tracers[2]], [b, c], 2, 2.0, [4.0, 6.0],
+            [Tracer.BUSY, Tracer.BUSY])
+        # b timed out after c already merged
+        self.record([tracers[1], tracers[2]], [b, c], 3, 3.0, [4.0, 6.0],
+            [Tracer.TIMEOUT, Tracer.OK])
+        for tracer in tracers:
+            tracer.close()
+
+    def test_load(self):
+        self.write_traces()
+        traces = gossip_replay.load_traces([self.folder])
+        self.assertEqual(['a', 'b', 'c'], sorted(traces))
+        node_ip, initial, records = traces['c']
+        self.assertEqual("10.0.0.3", node_ip)
+        self.assertEqual(6.0, initial)
+        self.assertEqual([2, 3], list(records['xid']))
+        # an incomplete last record is dropped
+        with open(os.path.join(self.folder, 'c.trace'), 'ab') as f:
+            f.write('xx')
+        self.assertEqual(2, len(gossip_replay.load_trace(
+            os.path.join(self.folder, 'c.trace'))[2]))
+
+    def test_replay(self):
+        self.write_traces()
+        replay = gossip_replay.GossipReplay(
+            gossip_replay.load_traces([self.folder]))
+        stats = replay.run()
+        self.assertEqual(3, stats['exchanges'])
+        self.assertEqual(1, stats['refused'])
+        self.assertEqual(1, stats['one_sided'])
+        self.assertEqual(0, stats['diverged'])
+        self.assertEqual(14.0, stats['initial_mass'])
+        self.assertEqual(13.0, stats['final_mass'])
+        self.assertEqual([3], [v['xid'] for v in stats['violations']])
+        self.assertEqual(-1.0, stats['violations'][0]['delta'])
+        self.assertEqual(4.0, replay.states['b'].current)
+        self.assertEqual(5.0, replay.states['c'].current)
+
+    def test_merge_rule(self):
+        self.write_traces()
+        replay = gossip_replay.GossipReplay(
+            gossip_replay.load_traces([self.folder]), MaxState)
+        stats = replay.run()
+        self.assertEqual(8.0, replay.states['a'].current)
+        self.assertEqual(8.0, replay.states['c'].current)
+        # b sends 8 instead of the recorded 4
+        self.assertEqual(1, stats['diverged'])
+
+    def test_weighted(self):
+        tracers = [Tracer("10.0.0.1", self.logger),
+            Tracer("10.0.0.2", self.logger)]
+        sessions = [self.make_session(name, state)
+            for name, state in zip('ab', [0.0, 15.0])]
+        self.record(tracers, sessions, 1, 1.0, [0.0, 15.0],
+            [Tracer.OK, Tracer.OK], weights=(1.0, 2.0))
+        for tracer in tracers:
+            tracer.close()
+        replay = gossip_replay.GossipReplay(
+            gossip_replay.load_traces([self.folder]))
+        stats = replay.run()
+        self.assertEqual(10.0, replay.states['a'].current)
+        self.assertEqual(1.5, replay.states['b'].weight)
+        self.assertEqual([], stats['violations'])
+
+    def test_overlapping_exchanges(self):
+        tracers = [Tracer("10.0.0.1", self.logger),
+            Tracer("10.0.0.2", self.logger), Tracer("10.0.0.3", self.logger)]
+        a, b, c = [self.make_session(name, state)
+            for name, state in zip('abc', [0.0, 8.0, 4.0])]
+        self.record([tracers[0], tracers[1]], [a, b], 1, 1.0, [0.0, 8.0],
+            [Tracer.OK, Tracer.OK])
+        # c locked first, a served it after its own exchange with b
+        self.record([tracers[2], tracers[0]], [c, a], 2, 0.5, [4.0, 4.0],
+            [Tracer.OK, Tracer.OK], passive_start=1.2)
+        for tracer in tracers:
+            tracer.close()
+        replay = gossip_replay.GossipReplay(
+            gossip_replay.load_traces([self.folder]))
+        stats = replay.run()
+        self.assertEqual(0, stats['diverged'])
+        self.assertEqual([], stats['violations'])
+        for name in 'abc':
+            self.assertEqual(4.0, replay.states[name].current)
+
+    def test_failing_trace_releases_lock(self):
+        session = self.make_session('a', 0.0)
+        config = make_config({})
+        passive = gossip.PassiveGossipThread(config, self.logger,
+            {'s': session}, None)
+        passive.tracer = BrokenTracer()
+        with self.assertRaises(IOError):
+            passive.serve(OneMessage({'session': 's', 'state': 4.0,
+                'xid': 1}))
+        self.assertEqual(2.0, session.gossip_state.try_get_and_acquire(0.1))
+        session.gossip_state.release()
+
+    def test_live_trace(self):
+        config = make_network_config()
+        addresses = [('a', "127.0.0.1", 0.0), ('b', "127.0.0.2", 10.0),
+            ('c', "127.0.0.3", 30.0)]
+        nodes = []
+        for name, node_ip, state in addresses:
+            session = self.make_session(name, state)
+            tracer = Tracer(node_ip, self.logger)
+            neighbours = dict((ip, ip) for n, ip, s in addresses
+                if ip != node_ip)
+            passive, active = make_threads(config, self.logger, node_ip,
+                {'s': session}, neighbours)
+            passive.tracer = active.tracer = tracer
+            start_passive(passive)
+            nodes.append((session, tracer, active))
+        for i in xrange(6):
+            session, tracer, active = nodes[i % 3]
+            active.exchange(session)
+            time.sleep(0.1)
+        for session, tracer, active in nodes:
+            session.gossip_epoch.stop()
+            tracer.close()
+
+        replay = gossip_replay.GossipReplay(
+            gossip_replay.load_traces([self.folder]))
+        stats = replay.run()
+        self.assertEqual(6, stats['merged'])
+        self.assertEqual(0, stats['diverged'])
+        self.assertEqual([], stats['violations'])
+        for session, tracer, active in nodes:
+            name = os.path.basename(session.trace_file)[0]
+            self.assertAlmostEqual(session.gossip_state.current,
+                replay.states[name].current)
+
+if __name__ == '__main__':
+    unittest.main()
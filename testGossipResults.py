@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+'''
+Title: Tests for the run result loader
+Author: Niklas Semmler
+'''
+import unittest
+import os
+import shutil
+import tempfile
+import numpy
+import gossip_results
+
+
+class TestGossipResults(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.run = os.path.join(self.root, 'averaging', 'ring', '1')
+        os.makedirs(self.run)
+        self.write('Node00', [(1, 10.0, 20), (1, 10.5, 25), (3, 31.0, 30)])
+        self.write('Node01', [(2, 21.0, 40), (2, 20.5, 35)])
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, node, lines, folder=None):
+        with open(os.path.join(folder or self.run, node + '.csv'), 'w') as f:
+            f.write("epoch,time,state\n")
+            for line in lines:
+                f.write("%s,%s,%s\n" % line)
+
+    def test_epochs(self):
+        run = gossip_results.load_run(self.run, use_cache=False)
+        self.assertEqual(['Node00', 'Node01'], run['nodes'])
+        self.assertEqual([1, 2, 3], list(run['columns']))
+        expected = numpy.array([[25, 25, 30], [numpy.nan, 40, 40]])
+        numpy.testing.assert_array_equal(expected, run['states'])
+
+    def test_bins(self):
+        run = gossip_results.load_run(self.run, bin_width=10,
+            use_cache=False)
+        self.assertEqual([10, 20, 30], list(run['columns']))
+        expected = numpy.array([[25, 25, 30], [numpy.nan, 40, 40]])
+        numpy.testing.assert_array_equal(expected, run['states'])
+
+    def test_cache(self):
+        first = gossip_results.load_run(self.run)
+        self.assertTrue(os.path.isfile(os.path.join(self.run,
+            gossip_results.CACHE_FILE)))
+        cached = gossip_results.load_run(self.run)
+        numpy.testing.assert_array_equal(first['states'], cached['states'])
+        self.assertEqual(first['nodes'], cached['nodes'])
+        # a changed node file is parsed again
+        self.write('Node01', [(2, 21.0, 40), (3, 32.0, 28)])
+        os.utime(os.path.join(self.run, 'Node01.csv'), (0, 0))
+        changed = gossip_results.load_run(self.run)
+        self.assertEqual(28, changed['states'][1, 2])
+
+    def test_many_runs(self):
+        other = os.path.join(self.root, 'averaging', 'ring', '2')
+        os.makedirs(other)
+        self.write('Node00', [(1, 1.0, 10), (2, 2.0, 10)], other)
+        self.write('Node01', [(1, 1.5, 10), (2, 2.5, 10)], other)
+        runs = gossip_results.load_runs(self.root, processes=2)
+        self.assertEqual([os.path.join('averaging', 'ring', '1'),
+            os.path.join('averaging', 'ring', '2')], sorted(runs))
+
+    def test_converged(self):
+        run = {'columns': numpy.array([1, 2, 3]),
+            'states': numpy.array([[0.0, 4.0, 5.0], [10.0, 6.0, 5.0]])}
+        self.assertEqual(3, gossip_results.converged(run, 0.1))
+        self.assertEqual(2, gossip_results.converged(run, 0.5))
+        run['states'][1, 2] = 6.0
+        self.assertEqual(None, gossip_results.converged(run, 0.01))
+
+    def test_ill_formatted(self):
+        self.write('Node02', [(1, 1.0, 10)])
+        with open(os.path.join(self.run, 'Node02.csv'), 'a') as f:
+            f.write("2,2.0\n")
+        with self.assertRaises(ValueError):
+            gossip_results.load_run(self.run, use_cache=False)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+'''
+Title: Tests for the spectral convergence predictor
+Author: Niklas Semmler
+'''
+import unittest
+import os
+import itertools
+import numpy
+import gossip_spectral
+
+class TestGossipSpectral(unittest.TestCase):
+    def setUp(self):
+        # path 0 - 1 - 2
+        self.adjacency = numpy.array([[0, 1, 0], [1, 0, 1], [0, 1, 0]])
+        self.neighbours = gossip_spectral.neighbour_lists(self.adjacency)
+
+    def test_cycle_second_moment(self):
+        # enumerate every choice of neighbours in one cycle
+        initial = numpy.identity(3) - 1.0 / 3
+        expected = numpy.zeros((3, 3))
+        choices = [list(js) for js in self.neighbours]
+        for picks in itertools.product(*choices):
+            operator = numpy.identity(3)
+            prob = 1.0
+            for i, j in enumerate(picks):
+                v = numpy.zeros(3)
+                v[i], v[j] = 1, -1
+                operator = numpy.dot(
+                    numpy.identity(3) - numpy.outer(v, v) / 2, operator)
+                prob /= len(self.neighbours[i])
+            expected += prob * numpy.dot(
+                numpy.dot(operator, initial), operator.T)
+        result = gossip_spectral.cycle_second_moment(initial, self.neighbours)
+        self.assertTrue(numpy.allclose(expected, result))
+
+    def test_predict(self):
+        prediction = gossip_spectral.predict(self.adjacency, 1e-3)
+        self.assertTrue(0 < prediction['rate'] < 1)
+        self.assertTrue(prediction['rate'] <= prediction['bound'])
+        self.assertAlmostEqual(
+            numpy.log(1e-3) / numpy.log(prediction['rate']),
+            prediction['cycles'])
+        self.assertEqual(2, prediction['links'])
+
+        disconnected = numpy.zeros((4, 4))
+        disconnected[0, 1] = disconnected[1, 0] = 1
+        disconnected[2, 3] = disconnected[3, 2] = 1
+        with self.assertRaises(ValueError):
+            gossip_spectral.predict(disconnected)
+
+    def test_predict_file_cache(self):
+        file_adjacency = os.tempnam()
+        numpy.savetxt(file_adjacency, self.adjacency, fmt='%d', delimiter=",")
+        prediction = gossip_spectral.predict_file(file_adjacency)
+        self.assertTrue(os.path.isfile(file_adjacency + '.spectral'))
+        self.assertEqual(prediction,
+            gossip_spectral.predict_file(file_adjacency))
+        os.remove(file_adjacency)
+        os.remove(file_adjacency + '.spectral')
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+'''
+Title: Tests for the experiment sweep scheduler
+Author: Niklas Semmler
+'''
+import unittest
+import os
+import shutil
+import tempfile
+import load_exp
+import gossip_sweep
+
+class TestGossipSweep(unittest.TestCase):
+    def setUp(self):
+        self.topologies = tempfile.mkdtemp()
+        self.output = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.topologies, 'GraphXYZ'))
+        shutil.copy('test_graph',
+            os.path.join(self.topologies, 'GraphXYZ', 'adjmat'))
+        self.exp_dict = {
+            'Graph': {'name': 'GraphXYZ'},
+            'Operation': {'name': 'averaging, counting'},
+            'Run': {'cycles': '5', 'runs': '1-2'},
+            'Sweep': {'mode': 'simulate', 'topologies': self.topologies,
+                'output': self.output}
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.topologies)
+        shutil.rmtree(self.output)
+
+    def test_expand_values(self):
+        self.assertEqual(['1', '2', '3', 'x'],
+            gossip_sweep.expand_values('1-3, x'))
+        self.assertEqual(['uniform:0.1,0.2', 'exp:0.1'],
+            gossip_sweep.expand_values('uniform:0.1,0.2 | exp:0.1'))
+
+    def test_expand_grid(self):
+        exp_dict = load_exp.parse_exp_file('example_sweep_file')
+        jobs = gossip_sweep.expand_grid(exp_dict)
+        self.assertEqual(4 * 2 * 10 * 2 * 2, len(jobs))
+        self.assertEqual(len(jobs), len(set(job['path'] for job in jobs)))
+        self.assertEqual(
+            os.path.join('results/', 'averaging', 'Reuna', '1',
+                'latency=exp:0.005,loss=0'),
+            jobs[0]['path'])
+
+    def test_simulate_without_parameters(self):
+        self.exp_dict['Parameters'] = {'loss': '0, 0.01'}
+        with self.assertRaises(ValueError):
+            gossip_sweep.expand_grid(self.exp_dict)
+
+    def test_run_sweep_and_resume(self):
+        results = {}
+        count = gossip_sweep.run_sweep(self.exp_dict, 1, results.__setitem__)
+        self.assertEqual(4, count)
+        self.assertEqual(['done'] * 4, results.values())
+        path = os.path.join(self.output, 'counting', 'GraphXYZ', '1')
+        with open(os.path.join(path, 'Node00.csv'), 'r') as f:
+            self.assertEqual("epoch,time,state\n", f.readline())
+        # counting conserves the single 1
+        total = 0.0
+        for node in xrange(8):
+            with open(os.path.join(path, 'Node%02d.csv' % node), 'r') as f:
+                total += float(f.readlines()[-1].split(',')[2])
+        self.assertAlmostEqual(1.0, total)
+
+        # finished jobs are skipped, removed results are run again
+        os.remove(os.path.join(path, '.done'))
+        self.assertEqual(1, gossip_sweep.run_sweep(self.exp_dict, 1))
+        self.assertEqual(0, gossip_sweep.run_sweep(self.exp_dict, 1))
+
+    def test_failed_job(self):
+        # Node02 has no neighbours
+        os.makedirs(os.path.join(self.topologies, 'Isolated'))
+        with open(os.path.join(self.topologies, 'Isolated', 'adjmat'),
+                'w') as f:
+            f.write("0,1,0\n1,0,0\n0,0,0\n")
+        self.exp_dict['Graph']['name'] = 'Isolated, GraphXYZ'
+        results = {}
+        self.assertEqual(8, gossip_sweep.run_sweep(self.exp_dict, 2,
+            results.__setitem__))
+        failed = [path for path, result in results.items()
+            if result.startswith('failed')]
+        self.assertEqual(4, len(failed))
+        self.assertTrue(all('Isolated' in path for path in failed))
+
+    def test_eventsim_jobs(self):
+        self.exp_dict['Operation']['name'] = 'averaging'
+        self.exp_dict['Run']['runs'] = '1'
+        self.exp_dict['Parameters'] = {'latency': 'const:0.01', 'loss': '0'}
+        self.exp_dict['Sweep']['mode'] = 'eventsim'
+        results = {}
+        self.assertEqual(1, gossip_sweep.run_sweep(self.exp_dict, 1,
+            results.__setitem__))
+        path = os.path.join(self.output, 'averaging', 'GraphXYZ', '1',
+            'latency=const:0.01,loss=0')
+        self.assertEqual({path: 'done'}, results)
+        self.assertTrue(os.path.isfile(os.path.join(path, 'stats.json')))
+
+    def test_command_jobs(self):
+        self.exp_dict['Sweep'].update({'mode': 'command', 'cores': '0, 1',
+            'ports': '6000-6003',
+            'command': 'echo {graph} {run} {recv_port} {send_port} {core}'})
+        results = {}
+        self.assertEqual(4, gossip_sweep.run_sweep(self.exp_dict,
+            report=results.__setitem__))
+        self.assertEqual(['done'] * 4, results.values())
+        with open(os.path.join(self.output, 'averaging', 'GraphXYZ', '2',
+                'command.log'), 'r') as f:
+            graph, run, recv_port, send_port, core = f.read().split()
+        self.assertEqual(('GraphXYZ', '2'), (graph, run))
+        self.assertTrue((recv_port, send_port) in
+            [('6000', '6001'), ('6002', '6003')])
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+'''
+Title: Tests for the batch topology conversion
+Author: Niklas Semmler
+'''
+import unittest
+import os
+import shutil
+import tempfile
+import gossip
+import gossip_topology
+
+GRAPHML = """<?xml version="1.0" encoding="utf-8"?>
+<graphml xmlns="http://graphml.graphdrawing.org/xmlns">
+  <key attr.name="label" attr.type="string" for="node" id="d0" />
+  <graph edgedefault="undirected">
+    <node id="a"><data key="d0">%s</data></node>
+    <node id="b"><data key="d0">Paris</data></node>
+    <node id="c"><data key="d0">Rome</data></node>
+    <edge source="a" target="b" />
+    <edge source="b" target="a" />
+    <edge source="b" target="c" />
+    <edge source="c" target="c" />
+  </graph>
+</graphml>
+"""
+
+class TestGossipTopology(unittest.TestCase):
+    def setUp(self):
+        self.source = tempfile.mkdtemp()
+        self.dest = tempfile.mkdtemp()
+        self.write_graphml('Berlin')
+
+    def tearDown(self):
+        shutil.rmtree(self.source)
+        shutil.rmtree(self.dest)
+
+    def write_graphml(self, label):
+        with open(os.path.join(self.source, 'Tiny.graphml'), 'w') as f:
+            f.write(GRAPHML % label)
+
+    def test_parse_graphml(self):
+        graph = gossip_topology.parse_graphml(
+            os.path.join(self.source, 'Tiny.graphml'))
+        self.assertEqual([['a', 'Berlin'], ['b', 'Paris'], ['c', 'Rome']],
+            graph['nodes'])
+        self.assertEqual([(0, 1), (1, 2)], graph['edges'])
+
+    def test_host_addresses(self):
+        self.assertEqual(['10.0.0.255', '10.0.1.0'],
+            gossip_topology.host_addresses('10.0.0.254', 2))
+
+    def test_convert_folder(self):
+        results = gossip_topology.convert_folder(self.source, self.dest,
+            processes=1)
+        self.assertEqual({'Tiny': 'converted'}, results)
+        folder = os.path.join(self.dest, 'Tiny')
+        with open(os.path.join(folder, 'adjmat'), 'r') as f:
+            self.assertEqual("0,1,0\n1,0,1\n0,1,0\n", f.read())
+        # neighbour lists are readable by the daemon
+        daemon = gossip.GossipDaemon.__new__(gossip.GossipDaemon)
+        daemon.logger = gossip.logging.getLogger("test")
+        self.assertEqual({'Node00': '10.0.0.1', 'Node02': '10.0.0.3'},
+            daemon.read_file_of_neighbours(
+                os.path.join(folder, 'neighbours', 'Node01')))
+
+        # nothing to do unless the GraphML changes
+        results = gossip_topology.convert_folder(self.source, self.dest,
+            processes=1)
+        self.assertEqual({'Tiny': 'up to date'}, results)
+        self.write_graphml('Munich')
+        results = gossip_topology.convert_folder(self.source, self.dest,
+            processes=1)
+        self.assertEqual({'Tiny': 'converted'}, results)
+        self.assertEqual(2, len(os.listdir(os.path.join(self.dest, '.cache'))))
+
+    def test_removed_nodes(self):
+        gossip_topology.convert_folder(self.source, self.dest, processes=1)
+        # Rome is gone
+        with open(os.path.join(self.source, 'Tiny.graphml'), 'w') as f:
+            f.write('\n'.join(line for line in (GRAPHML % 'Berlin').split(
+                '\n') if '"c"' not in line))
+        gossip_topology.convert_folder(self.source, self.dest, processes=1)
+        self.assertEqual(['Node00', 'Node01'], sorted(os.listdir(
+            os.path.join(self.dest, 'Tiny', 'neighbours'))))